@@ -7,6 +7,8 @@
 import enum
 from collections import namedtuple
 
+import numpy
+
 
 # General
 ACTION_ATTACK = 'attack'
@@ -44,6 +46,10 @@ COSTS = {
     ACTION_BUILD_SUPPLY: Cost(minerals=100),
 }
 
+# NOTE (alkurbatov): Actions available in the last seen observation,
+# see available().
+_available = {'observation': None, 'actions': frozenset()}
+
 
 @enum.unique
 class Stages(enum.IntEnum):
@@ -59,9 +65,20 @@ class Stages(enum.IntEnum):
     ISSUE_ORDER = 2
 
 
+def available(obs):
+    """Get set of the actions available in the observation.
+    The set is built once per observation.
+    """
+    if _available['observation'] is not obs.observation:
+        _available['observation'] = obs.observation
+        _available['actions'] = frozenset(obs.observation.available_actions.tolist())
+
+    return _available['actions']
+
+
 def can(obs, action_id):
     """Returns True if the specified action is available."""
-    return action_id in obs.observation.available_actions
+    return action_id in available(obs)
 
 
 def cannot(obs, action_id):
@@ -77,6 +94,31 @@ def cannot_afford(obs, action_id):
     if not cost:
         return True
 
-    return obs.observation.player.minerals < cost.minerals or \
-           obs.observation.player.vespene < cost.vespene or \
-           obs.observation.player.food_cap - obs.observation.player.food_used < cost.food
+    return bool((numpy.asarray(cost) > resources(obs)).any())
+
+
+def cost_matrix(action_ids):
+    """Get costs of the actions as array with a row (minerals, vespene, food)
+    per action. The actions without costs are free.
+    """
+    return numpy.array(
+        [COSTS.get(action_id, Cost()) for action_id in action_ids],
+        dtype=numpy.int64
+    ).reshape(len(action_ids), len(Cost._fields))
+
+
+def resources(obs):
+    """Get the resources available to spend as array aligned with Cost."""
+    player = obs.observation.player
+    return numpy.array(
+        [player.minerals, player.vespene, player.food_cap - player.food_used],
+        dtype=numpy.int64
+    )
+
+
+def cannot_afford_many(costs, available_resources):
+    """Get boolean mask of the actions which cost more than the available
+    resources, see cost_matrix() and resources(). The mask could be passed
+    to the QLearning table as the excluded actions.
+    """
+    return (costs > available_resources).any(axis=1)
@@ -7,12 +7,27 @@ All values measured in number of points assuming that the screens resolution is
 84x84 pixels (defaults).
 For more info please check
 https://itnext.io/how-to-locate-and-select-units-in-pysc2-2bb1c81f2ad3
+
+Use footprint() to get the values for other resolutions of the screen
+or the minimap.
 """
 
+import functools
+
 from pysc2.lib import units
 
 
-DIAMETERS = {
+# NOTE (alkurbatov): The default screen shows 24x24 world units
+# (the default camera width of pysc2) in 84x84 pixels.
+BASE_RESOLUTION = (84, 84)
+CAMERA_WIDTH = 24
+
+# NOTE (alkurbatov): The beacon of the MoveToBeacon minigame
+# is not listed in pysc2.lib.units.
+BEACON = 317
+
+AREAS = {
+    BEACON: 80,
     units.Neutral.MineralField: 44,
     units.Neutral.VespeneGeyser: 97,
     units.Terran.CommandCenter: 287,
@@ -21,3 +36,31 @@ DIAMETERS = {
     units.Terran.SCV: 12,
     units.Terran.SupplyDepot: 69,
 }
+
+
+@functools.lru_cache(maxsize=None)
+def footprints(size, world_size=(CAMERA_WIDTH, CAMERA_WIDTH)):
+    """Get number of points covered by the units on a layer of the specified
+    size (width, height) showing world_size (width, height) world units,
+    i.e. the camera width for the screen or the map size for the minimap.
+    The values are cached per size.
+    """
+    scale = size[0] / world_size[0] * size[1] / world_size[1]
+    scale /= BASE_RESOLUTION[0] / CAMERA_WIDTH * BASE_RESOLUTION[1] / CAMERA_WIDTH
+
+    return {
+        unit_type: max(1, int(round(area * scale)))
+        for unit_type, area in AREAS.items()
+    }
+
+
+def footprint(unit_type, size, world_size=(CAMERA_WIDTH, CAMERA_WIDTH)):
+    """Get number of points covered by the unit, see footprints().
+    Returns None for unknown units.
+    """
+    return footprints(tuple(size), tuple(world_size)).get(unit_type)
+
+
+def resolution(layer):
+    """Get resolution (width, height) of the feature layer."""
+    return layer.shape[1], layer.shape[0]
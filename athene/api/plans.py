@@ -0,0 +1,116 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Declarative description of the smart actions executed in several steps
+(see Stages), e.g. select an SCV first and order it to build a supply depot.
+"""
+
+from pysc2.lib import actions
+
+from .actions import Stages, cannot
+
+
+class ActionPlan:
+    """Steps of a smart action. The callbacks receive the observation and
+    the context passed to Planner.step() and return the function call to
+    execute. A callback returning None is repeated on the next game step.
+
+        Meaning of variables:
+        select          - callback selecting the units, if needed.
+        issue           - callback issuing the order, if needed.
+        select_requires - id of the function which must be available
+                          to select the units, otherwise the plan is aborted.
+        issue_requires  - id of the function which must be available
+                          to issue the order, otherwise the plan is aborted.
+
+    The plan without callbacks takes a single game step doing nothing.
+    """
+
+    def __init__(self, select=None, issue=None, select_requires=None,
+                 issue_requires=None):
+        self.select = select
+        self.issue = issue
+        self.select_requires = select_requires
+        self.issue_requires = issue_requires
+
+
+class Planner:
+    """Executes the plans of the smart actions step by step. The plans are
+    kept in a dispatch table by the names of the smart actions, so each game
+    step costs a couple of dictionary lookups.
+    """
+
+    def __init__(self, plans=None):
+        self.plans = dict(plans or {})
+        self.stage = Stages.CHOOSE_ACTION
+        self.action = None
+        self.plan = None
+
+        self._stages = {
+            Stages.SELECT_UNIT: self._select,
+            Stages.ISSUE_ORDER: self._issue,
+        }
+
+    def register(self, action, plan):
+        """Add plan of the smart action."""
+        self.plans[action] = plan
+
+    def reset(self):
+        """Forget the current plan, e.g. at the start of an episode."""
+        self.stage = Stages.CHOOSE_ACTION
+        self.action = None
+        self.plan = None
+
+    @property
+    def idle(self):
+        """Returns True if it is time to choose the next smart action."""
+        return self.stage == Stages.CHOOSE_ACTION
+
+    def start(self, action):
+        """Start execution of the smart action on the next step."""
+        self.action = action
+        self.plan = self.plans[action]
+        self.stage = Stages.SELECT_UNIT
+
+    def step(self, obs, *context):
+        """Make the next step of the current plan. Returns the function call
+        to execute or None if the plan is done and it is time to choose
+        the next smart action.
+        """
+        stage = self._stages.get(self.stage)
+        if stage is None:
+            return None
+
+        return stage(obs, context)
+
+    def _select(self, obs, context):
+        plan = self.plan
+        if plan.select is None:
+            return self._issue(obs, context)
+
+        return self._run(
+            obs, context, plan.select, plan.select_requires,
+            Stages.ISSUE_ORDER if plan.issue is not None else Stages.CHOOSE_ACTION)
+
+    def _issue(self, obs, context):
+        plan = self.plan
+        if plan.issue is None:
+            self.stage = Stages.CHOOSE_ACTION
+            return actions.FUNCTIONS.no_op()
+
+        return self._run(obs, context, plan.issue, plan.issue_requires,
+                         Stages.CHOOSE_ACTION)
+
+    def _run(self, obs, context, callback, requires, next_stage):
+        """Run the callback of the current stage and move to the next one."""
+        if requires is not None and cannot(obs, requires):
+            self.stage = Stages.CHOOSE_ACTION
+            return actions.FUNCTIONS.no_op()
+
+        call = callback(obs, *context)
+        if call is None:
+            return actions.FUNCTIONS.no_op()
+
+        self.stage = next_stage
+        return call
@@ -8,27 +8,35 @@ from feature_screen.
 
 import math
 import random
+from collections import namedtuple
 
 import numpy
-from sklearn.cluster import KMeans
 
-from .geometry import DIAMETERS
+from .geometry import footprint, resolution
 
 
-class UnitPos:
+# NOTE (alkurbatov): Units located in the last seen observation,
+# see locate_many().
+_located = {'observation': None, 'units': {}}
+
+# NOTE (alkurbatov): Strided samples of the screen layers of the last seen
+# observation, see pyramid_level().
+_pyramid = {'observation': None, 'levels': {}}
+
+
+class UnitPos(namedtuple('UnitPos', ['pos_x', 'pos_y'])):
     """Generic representation of a unit received from feature_screen.unit_types.
     Operates with approximate center of the provided geometry.
     """
 
-    def __init__(self, pos_x, pos_y):
+    __slots__ = ()
+
+    def __new__(cls, pos_x, pos_y):
         if isinstance(pos_x, (list, tuple, numpy.ndarray)):
-            center = numpy.mean(list(zip(pos_x, pos_y)), axis=0).round()
-            self.pos_x = center[0]
-            self.pos_y = center[1]
-            return
+            pos_x = float(numpy.asarray(pos_x).mean().round())
+            pos_y = float(numpy.asarray(pos_y).mean().round())
 
-        self.pos_x = pos_x
-        self.pos_y = pos_y
+        return super(UnitPos, cls).__new__(cls, pos_x, pos_y)
 
     def __str__(self):
         return '(x:{}, y:{})'.format(self.pos_x, self.pos_y)
@@ -36,7 +44,7 @@ class UnitPos:
     @property
     def pos(self):
         """Get the unit's position on the map."""
-        return [self.pos_x, self.pos_y]
+        return self
 
     def shift(self, shift_x, shift_y):
         """Return shifted position of this unit."""
@@ -45,37 +53,112 @@ class UnitPos:
 
 class UnitPosList:
     """Generic representation of units list from feature_screen.unit_types.
+    The diameter is the number of points covered by a single unit,
+    see athene.api.geometry.footprint().
     """
 
     def __init__(self, pos_x, pos_y, diameter=None):
         self.pos_x = pos_x
         self.pos_y = pos_y
         self.diameter = diameter
+        self._blobs = None
 
     @staticmethod
     def locate(obs, unit_type):
         """Find all the visible units of the specified type and
         return as a list.
         """
-        unit_types = obs.observation.feature_screen.unit_type
-        units_y, units_x = (unit_types == unit_type).nonzero()
-        return UnitPosList(units_x, units_y, diameter=DIAMETERS.get(unit_type))
+        return locate_many(obs, (unit_type,))[unit_type]
 
-    def __nonzero__(self):
+    def __bool__(self):
         """Returns false if there are no items in the list."""
-        return self.pos_y.any()
+        return len(self.pos_y) > 0
 
     def random_point(self):
         """Select a random point from the list."""
-        i = random.randint(0, len(self.pos_y) - 1)
+        i = random.randrange(len(self.pos_y))
         return UnitPos(self.pos_x[i], self.pos_y[i])
 
+    def __len__(self):
+        """Get units count. The units are counted by segmentation of
+        the points into blobs, see UnitPosBlobsList.
+        """
+        if not len(self.pos_y):
+            return 0
+
+        return len(self.blobs)
+
+    @property
+    def blobs(self):
+        """Get the units segmented into blobs."""
+        if self._blobs is None:
+            self._blobs = UnitPosBlobsList(self.pos_x, self.pos_y, self.diameter)
+
+        return self._blobs
+
+
+class UnitPosSet:
+    """Base class of the units lists keeping centers of the units
+    in an array. Removal of a unit swaps it with the last one,
+    so it costs O(1) and doesn't keep order of the units.
+    """
+
+    def __init__(self, centers):
+        self.centers = numpy.asarray(centers, dtype=numpy.float64).reshape(-1, 2)
+        self.count = len(self.centers)
+
     def __len__(self):
         """Get units count."""
-        return int(math.ceil(len(self.pos_y) / self.diameter))
+        return self.count
+
+    def __getitem__(self, i):
+        if not -self.count <= i < self.count:
+            raise IndexError('unit index out of range')
+
+        return UnitPos(*self.centers[i % self.count].tolist())
+
+    @property
+    def cluster_centers(self):
+        """Get centers of the units as a list of [x, y]."""
+        return self.centers[:self.count].tolist()
+
+    def random_unit(self):
+        """Select a random unit from the list.
+        """
+        return self[random.randrange(self.count)]
+
+    def pop_random_unit(self):
+        """Select a random unit and remove it from the list.
+        """
+        return self.pop(random.randrange(self.count))
+
+    def pop(self, i):
+        """Remove the unit from the list and return it."""
+        unit = self[i]
+
+        i %= self.count
+        last = self.count - 1
+        for column in self._columns():
+            column[i] = column[last]
+
+        self.count = last
+        return unit
+
+    def distances(self, unit):
+        """Get distances from the unit to each unit of the list."""
+        centers = self.centers[:self.count]
+        return numpy.hypot(centers[:, 0] - unit.pos_x, centers[:, 1] - unit.pos_y)
+
+    def nearest(self, unit):
+        """Get the unit of the list closest to the specified one."""
+        return self[int(self.distances(unit).argmin())]
+
+    def _columns(self):
+        """Get arrays holding a row per unit, see pop()."""
+        return (self.centers,)
 
 
-class UnitPosClustersList:
+class UnitPosClustersList(UnitPosSet):
     """Another representation of units list from feature_screen.unit_types.
     The units positions are identified by forming clusters of points.
 
@@ -84,34 +167,419 @@ class UnitPosClustersList:
     """
 
     def __init__(self, pos_x, pos_y, diameter):
+        # NOTE (alkurbatov): scikit-learn takes seconds to import,
+        # so it is loaded only when the clustering is really used.
+        from sklearn.cluster import KMeans
+
         kmeans = KMeans(n_clusters=math.ceil(len(pos_y) / diameter))
         kmeans.fit(numpy.column_stack((pos_x, pos_y)))
 
-        self.cluster_centers = kmeans.cluster_centers_.tolist()
+        super().__init__(kmeans.cluster_centers_)
 
     @staticmethod
     def locate(obs, unit_type):
         """Find all the visible units of the specified type and
         return as a list.
         """
-        unit_types = obs.observation.feature_screen.unit_type
-        units_y, units_x = (unit_types == unit_type).nonzero()
-        return UnitPosClustersList(units_x, units_y,
-                                   diameter=DIAMETERS.get(unit_type))
+        units = UnitPosList.locate(obs, unit_type)
+        return UnitPosClustersList(units.pos_x, units.pos_y, diameter=units.diameter)
 
-    def random_unit(self):
-        """Select a random unit from the list.
+
+class UnitPosBlobsList(UnitPosSet):
+    """Another representation of units list from feature_screen.unit_types.
+    The units are identified as connected blobs of points, the blobs
+    much bigger than the expected area of the unit (e.g. adjacent mineral
+    fields) are split into several units along the longer side.
+    Drop-in replacement of UnitPosClustersList which is way faster.
+    """
+
+    def __init__(self, pos_x, pos_y, diameter=None):
+        pos_x = numpy.asarray(pos_x)
+        pos_y = numpy.asarray(pos_y)
+
+        super().__init__(())
+        self.areas = numpy.zeros(0, dtype=numpy.intp)
+        self.bounding_boxes = numpy.zeros((0, 4), dtype=numpy.intp)
+
+        if not len(pos_x):
+            return
+
+        labels = label_blobs(pos_x, pos_y)
+        order = numpy.argsort(labels, kind='stable')
+        points_x = pos_x[order]
+        points_y = pos_y[order]
+
+        areas = numpy.bincount(labels)
+        starts = numpy.concatenate(([0], areas.cumsum()[:-1]))
+
+        units_count = numpy.ones(len(areas), dtype=numpy.intp)
+        if diameter:
+            units_count = numpy.maximum(1, numpy.rint(areas / diameter))
+            units_count = units_count.astype(numpy.intp)
+
+        centers, boxes = _stats(points_x, points_y, starts, areas)
+
+        single = units_count == 1
+        parts = [(centers[single], areas[single], boxes[single])]
+
+        for blob in (~single).nonzero()[0].tolist():
+            blob_points = slice(starts[blob], starts[blob] + areas[blob])
+            parts.append(_split_blob(
+                points_x[blob_points], points_y[blob_points], units_count[blob]))
+
+        self.centers = numpy.concatenate([part[0] for part in parts])
+        self.areas = numpy.concatenate([part[1] for part in parts])
+        self.bounding_boxes = numpy.concatenate([part[2] for part in parts])
+        self.count = len(self.centers)
+
+    @staticmethod
+    def locate(obs, unit_type, coarse=False):
+        """Find all the visible units of the specified type and
+        return as a list. The coarse search (see locate_coarse()) only pays
+        off for few compact units on the large screens.
         """
-        random_unit = random.choice(self.cluster_centers)
-        return UnitPos(random_unit[0], random_unit[1])
+        if coarse:
+            units = locate_coarse(obs, unit_type)
+        else:
+            units = UnitPosList.locate(obs, unit_type)
 
-    def pop_random_unit(self):
-        """Select a random unit and remove it from the list.
+        return UnitPosBlobsList(units.pos_x, units.pos_y, diameter=units.diameter)
+
+    def _columns(self):
+        return self.centers, self.areas, self.bounding_boxes
+
+
+def _stats(points_x, points_y, starts, areas):
+    """Get centers and bounding boxes (min x, min y, max x, max y) of
+    the groups of points, each group is a slice of the points arrays.
+    """
+    centers = numpy.column_stack((
+        numpy.add.reduceat(points_x, starts) / areas,
+        numpy.add.reduceat(points_y, starts) / areas,
+    ))
+    boxes = numpy.column_stack((
+        numpy.minimum.reduceat(points_x, starts),
+        numpy.minimum.reduceat(points_y, starts),
+        numpy.maximum.reduceat(points_x, starts),
+        numpy.maximum.reduceat(points_y, starts),
+    ))
+    return centers, boxes
+
+
+def _split_blob(pos_x, pos_y, units_count):
+    """Split the merged units along the longer side of the blob
+    into parts of equal area. Returns centers, areas and bounding boxes
+    of the parts.
+    """
+    if numpy.ptp(pos_x) >= numpy.ptp(pos_y):
+        order = numpy.argsort(pos_x, kind='stable')
+    else:
+        order = numpy.argsort(pos_y, kind='stable')
+
+    size, extra = divmod(len(order), units_count)
+    parts = numpy.arange(units_count)
+    starts = parts * size + numpy.minimum(parts, extra)
+    areas = numpy.diff(numpy.append(starts, len(order)))
+
+    centers, boxes = _stats(pos_x[order], pos_y[order], starts, areas)
+    return centers, areas, boxes
+
+
+def label_blobs(pos_x, pos_y):
+    """Label 8-connected blobs formed by the points.
+    Returns array of blob ids (0, 1, ...) in the order of the points.
+    The points are grouped into horizontal runs, then the runs touching
+    each other in the adjacent rows are joined using union-find.
+    """
+    pos_x = numpy.asarray(pos_x, dtype=numpy.intp)
+    pos_y = numpy.asarray(pos_y, dtype=numpy.intp)
+
+    order = numpy.lexsort((pos_x, pos_y))
+    points_x = pos_x[order]
+    points_y = pos_y[order]
+
+    breaks = (numpy.diff(points_y) != 0) | (numpy.diff(points_x) != 1)
+    starts = numpy.concatenate(([0], breaks.nonzero()[0] + 1))
+    ends = numpy.append(starts[1:], len(order)) - 1
+
+    runs_y = points_y[starts].tolist()
+    runs_start = points_x[starts].tolist()
+    runs_end = points_x[ends].tolist()
+    parent = list(range(len(runs_y)))
+
+    def find(run):
+        while parent[run] != run:
+            parent[run] = parent[parent[run]]
+            run = parent[run]
+
+        return run
+
+    # NOTE (alkurbatov): The runs are sorted by rows and columns, so
+    # the first candidate to touch the current run in the next row
+    # only moves forward.
+    candidate = 0
+    for run, row in enumerate(runs_y):
+        while candidate < len(runs_y) and \
+              (runs_y[candidate] <= row or
+               (runs_y[candidate] == row + 1 and
+                runs_end[candidate] < runs_start[run] - 1)):
+            candidate += 1
+
+        below = candidate
+        while below < len(runs_y) and runs_y[below] == row + 1 and \
+              runs_start[below] <= runs_end[run] + 1:
+            root, other = sorted((find(run), find(below)))
+            parent[other] = root
+            below += 1
+
+    roots = {}
+    runs_label = [roots.setdefault(find(run), len(roots)) for run in range(len(parent))]
+
+    labels = numpy.empty(len(order), dtype=numpy.intp)
+    labels[order] = numpy.array(runs_label)[numpy.concatenate(([0], breaks.cumsum()))]
+    return labels
+
+
+def locate_many(obs, unit_types):
+    """Find all the visible units of the specified types in a single pass
+    over feature_screen.unit_type. Returns dict of UnitPosList by unit type.
+    The result is cached for the observation, so repeated lookups
+    during the same step cost nothing.
+    """
+    # NOTE (alkurbatov): The layers of pysc2 are new views on each access,
+    # so the cache is bound to the observation itself.
+    if _located['observation'] is not obs.observation:
+        _located['observation'] = obs.observation
+        _located['units'] = {}
+
+    located = _located['units']
+    missing = [unit_type for unit_type in unit_types if unit_type not in located]
+
+    if missing:
+        layer = obs.observation.feature_screen.unit_type
+        points = _scan(numpy.asarray(layer).ravel(), missing)
+
+        for unit_type in missing:
+            located[unit_type] = _unit_pos_list(unit_type, points[unit_type], layer)
+
+    return {unit_type: located[unit_type] for unit_type in unit_types}
+
+
+def pyramid_level(obs, name, stride):
+    """Get the named layer of feature_screen sampled with the stride,
+    i.e. a downsampled copy of the layer. Each level is built once
+    per observation.
+    """
+    if _pyramid['observation'] is not obs.observation:
+        _pyramid['observation'] = obs.observation
+        _pyramid['levels'] = {}
+
+    level = _pyramid['levels'].get((name, stride))
+    if level is None:
+        layer = numpy.asarray(getattr(obs.observation.feature_screen, name))
+        offset = stride // 2
+        level = numpy.ascontiguousarray(layer[offset::stride, offset::stride])
+        _pyramid['levels'][(name, stride)] = level
+
+    return level
+
+
+def find_coarse(obs, name, value, stride):
+    """Find points of the named layer of feature_screen equal to the value.
+    Only the middle point of each stride x stride cell is checked first
+    (see pyramid_level()), then a window around each group of the found
+    cells is searched at the full resolution. Returns sorted flat indices
+    of the points, the same as the full scan gives unless some areas are
+    narrower than the stride and fall between the checked points.
+    """
+    layer = numpy.asarray(getattr(obs.observation.feature_screen, name))
+    if stride <= 1:
+        return (layer.ravel() == value).nonzero()[0]
+
+    hits = pyramid_level(obs, name, stride) == value
+
+    # NOTE (alkurbatov): The points of an area found in a cell lie within
+    # two strides from the checked point of the cell. The cells closer than
+    # four cells to each other are searched together, so the windows
+    # never overlap.
+    offset = stride // 2 - 2 * stride
+    span = 4 * stride + 1
+
+    points = []
+    for top, bottom in _cell_groups(hits.any(axis=1)):
+        for left, right in _cell_groups(hits[top:bottom + 1].any(axis=0)):
+            points.append(_find_in_window(
+                layer, value,
+                (max(0, top * stride + offset), bottom * stride + offset + span),
+                (max(0, left * stride + offset), right * stride + offset + span),
+            ))
+
+    if not points:
+        return numpy.zeros(0, dtype=numpy.intp)
+
+    if len(points) == 1:
+        return points[0]
+
+    points = numpy.concatenate(points)
+    points.sort()
+    return points
+
+
+def _find_in_window(layer, value, rows, columns):
+    """Get flat indices of the points of the layer window equal to the value.
+    The window is given by (first, end) of its rows and columns.
+    """
+    window = layer[rows[0]:rows[1], columns[0]:columns[1]]
+    points_y, points_x = (window == value).nonzero()
+    return (points_y + rows[0]) * layer.shape[1] + points_x + columns[0]
+
+
+def _cell_groups(hits):
+    """Get (first, last) indices of the groups of the found cells,
+    the cells of a group are less than five cells apart.
+    """
+    cells = hits.nonzero()[0]
+    if not cells.size:
+        return []
+
+    breaks = (numpy.diff(cells) > 4).nonzero()[0]
+    firsts = numpy.concatenate(([cells[0]], cells[breaks + 1]))
+    lasts = numpy.append(cells[breaks], cells[-1])
+    return zip(firsts.tolist(), lasts.tolist())
+
+
+def coarse_stride(area):
+    """Get stride of the coarse search for the objects covering
+    the specified number of points. The stride is a half of the width
+    of the object, so the object couldn't fall between the samples.
+    """
+    return max(1, int(math.sqrt(area or 1)) // 2)
+
+
+def locate_coarse(obs, unit_type, stride=None):
+    """Find all the visible units of the specified type using the coarse
+    search, see find_coarse(). By default the stride is chosen from
+    the expected size of the unit, see coarse_stride().
+    Returns UnitPosList, see locate_many().
+    """
+    layer = obs.observation.feature_screen.unit_type
+    if stride is None:
+        stride = coarse_stride(footprint(unit_type, resolution(layer)))
+
+    points = find_coarse(obs, 'unit_type', unit_type, stride)
+    return _unit_pos_list(unit_type, points, layer)
+
+
+class ScreenTracker:
+    """Keeps track of the units of the specified types between the steps.
+    Only the points of feature_screen.unit_type changed since the previous
+    step are examined and only the lists of the units having changed points
+    are rebuilt, the others (and the units counted in them) are reused.
+    The whole screen is rescanned at the start of an episode and when
+    a large part of it has changed, e.g. after a camera move.
+
+        Meaning of variables:
+        rescan_ratio - part of the changed points after which the whole
+                       screen is rescanned.
+    """
+
+    def __init__(self, unit_types, rescan_ratio=0.25):
+        self.unit_types = tuple(unit_types)
+        self.rescan_ratio = rescan_ratio
+
+        self.frame = None
+        self.points = {}
+        self.units = {}
+
+        self.rescans = 0
+        self.updates = 0
+
+    def update(self, obs):
+        """Get the units visible in the observation as dict of UnitPosList
+        by unit type, see locate_many().
         """
-        random_unit = random.choice(self.cluster_centers)
-        self.cluster_centers.remove(random_unit)
-        return UnitPos(random_unit[0], random_unit[1])
+        layer = obs.observation.feature_screen.unit_type
+        unit_type_ids = numpy.asarray(layer).ravel()
 
-    def __len__(self):
-        """Get units count."""
-        return len(self.cluster_centers)
+        if self.frame is None or obs.first() or self.frame.shape != unit_type_ids.shape:
+            self._rescan(unit_type_ids, layer)
+            return self._located(obs)
+
+        changed = (unit_type_ids != self.frame).nonzero()[0]
+        if len(changed) > self.rescan_ratio * len(unit_type_ids):
+            self._rescan(unit_type_ids, layer)
+            return self._located(obs)
+
+        self.updates += 1
+        if not len(changed):
+            return self._located(obs)
+
+        before = self.frame[changed]
+        after = unit_type_ids[changed]
+
+        for unit_type in self.unit_types:
+            removed = changed[before == unit_type]
+            added = changed[after == unit_type]
+            if not len(removed) and not len(added):
+                continue
+
+            # NOTE (alkurbatov): The points are kept sorted, so the lists
+            # are the same as produced by the full scan.
+            points = self.points[unit_type]
+            points = numpy.delete(points, numpy.searchsorted(points, removed))
+            points = numpy.insert(points, numpy.searchsorted(points, added), added)
+
+            self.points[unit_type] = points
+            self.units[unit_type] = _unit_pos_list(unit_type, points, layer)
+
+        self.frame[changed] = after
+        return self._located(obs)
+
+    def _rescan(self, unit_type_ids, layer):
+        """Find all the tracked units on the screen."""
+        self.rescans += 1
+        self.frame = unit_type_ids.copy()
+        self.points = _scan(unit_type_ids, self.unit_types)
+        self.units = {
+            unit_type: _unit_pos_list(unit_type, self.points[unit_type], layer)
+            for unit_type in self.unit_types
+        }
+
+    def _located(self, obs):
+        """Share the tracked units with locate_many() and return them."""
+        if _located['observation'] is not obs.observation:
+            _located['observation'] = obs.observation
+            _located['units'] = {}
+
+        _located['units'].update(self.units)
+        return dict(self.units)
+
+
+def _scan(unit_type_ids, unit_types):
+    """Find points of the specified unit types in the flattened
+    unit_type layer. Returns dict of sorted flat indices by unit type.
+    """
+    # NOTE (alkurbatov): The lookup table has an extra False item at
+    # the end, unit types out of the table are clipped to it.
+    wanted = numpy.zeros(max(unit_types) + 2, dtype=numpy.bool_)
+    wanted[list(unit_types)] = True
+    points = wanted.take(unit_type_ids, mode='clip').nonzero()[0]
+
+    # NOTE (alkurbatov): Bucket the found points by unit type, stable sort
+    # keeps the points of each type in the row-major order.
+    points = points[numpy.argsort(unit_type_ids[points], kind='stable')]
+    found = unit_type_ids[points]
+
+    located = {}
+    for unit_type in unit_types:
+        start, end = numpy.searchsorted(found, (unit_type, unit_type + 1))
+        located[unit_type] = points[start:end]
+
+    return located
+
+
+def _unit_pos_list(unit_type, points, layer):
+    """Make list of the units from flat indices of the points on the layer."""
+    units_y, units_x = numpy.divmod(points, layer.shape[1])
+    return UnitPosList(
+        units_x, units_y, diameter=footprint(unit_type, resolution(layer)))
@@ -0,0 +1,193 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Compact binary format of the QLearning table checkpoints.
+
+A checkpoint file is a sequence of records, each record consists of:
+    magic       - 4 bytes, b'ATHQ'.
+    version     - uint16, version of the format.
+    length      - uint32, length of the description.
+    description - JSON with metadata and the list of the stored arrays.
+    arrays      - raw data of the arrays, each one aligned to ALIGNMENT bytes.
+
+Base checkpoints contain a single record, delta files get a new record
+appended on each save. The arrays are memory-mapped on reading.
+"""
+
+import contextlib
+import json
+import os
+import struct
+
+import numpy
+
+from athene.storage import writer
+
+
+MAGIC = b'ATHQ'
+VERSION = 1
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct('<4sHI')
+
+
+def write(f, arrays, **meta):
+    """Write a record into the binary file opened for writing."""
+    arrays = {name: numpy.ascontiguousarray(array) for name, array in arrays.items()}
+
+    header, _ = _header(
+        [(name, array.dtype, array.shape) for name, array in arrays.items()], meta)
+    f.write(header)
+
+    for array in arrays.values():
+        array.tofile(f)
+        f.write(bytes(_aligned(array.nbytes) - array.nbytes))
+
+
+@contextlib.contextmanager
+def create(path, specs, **meta):
+    """Create a file with a single record of the arrays described by
+    the list of (name, dtype, shape) and yield dict of the arrays
+    memory-mapped for filling, so the arrays don't have to fit into RAM.
+    The file appears at the path atomically once the filling is done.
+    """
+    specs = [(name, numpy.dtype(dtype), tuple(shape)) for name, dtype, shape in specs]
+    header, offsets = _header(specs, meta)
+
+    with writer.atomic_write(path, mode='w+b') as f:
+        f.write(header)
+        f.truncate(len(header) + offsets['size'])
+        f.flush()
+
+        arrays = {}
+        for name, dtype, shape in specs:
+            if not int(numpy.prod(shape)):
+                arrays[name] = numpy.zeros(shape, dtype=dtype)
+                continue
+
+            arrays[name] = numpy.memmap(
+                f, dtype=dtype, mode='r+', offset=len(header) + offsets[name],
+                shape=shape)
+
+        yield arrays
+
+        for array in arrays.values():
+            if isinstance(array, numpy.memmap):
+                array.flush()
+
+
+def save(path, arrays, **meta):
+    """Atomically replace the file with a single record."""
+    with writer.atomic_write(path) as f:
+        write(f, arrays, **meta)
+
+
+def append(path, arrays, **meta):
+    """Append a record to the file. A truncated record left at the end
+    of the file by a crash is overwritten.
+    """
+    with open(path, 'ab') as f:
+        pass
+
+    with open(path, 'r+b') as f:
+        f.seek(valid_size(path))
+        f.truncate()
+        write(f, arrays, **meta)
+
+
+def valid_size(path):
+    """Get size of the complete records in the file."""
+    size = 0
+    with open(path, 'rb') as f:
+        for _, _, end in _records(f, os.path.getsize(path)):
+            size = end
+
+    return size
+
+
+def read(path, mmap=True):
+    """Iterate over records of the file. Yields pairs of the metadata dict and
+    the dict of arrays. Truncated records at the end of the file
+    (e.g. after a crash during append) are ignored.
+    """
+    with open(path, 'rb') as f:
+        for description, data, _ in _records(f, os.path.getsize(path)):
+            arrays = {}
+            for spec in description.pop('arrays'):
+                dtype = numpy.dtype(spec['dtype'])
+                shape = tuple(spec['shape'])
+                count = int(numpy.prod(shape))
+
+                if mmap and count:
+                    arrays[spec['name']] = numpy.memmap(
+                        path, dtype=dtype, mode='r',
+                        offset=data + spec['offset'], shape=shape)
+                    continue
+
+                f.seek(data + spec['offset'])
+                arrays[spec['name']] = numpy.fromfile(
+                    f, dtype=dtype, count=count).reshape(shape)
+
+            yield description, arrays
+
+
+def _records(f, file_size):
+    """Iterate over complete records of the opened file.
+    Yields the description, offset of the arrays data and end of the record.
+    """
+    position = 0
+    while position + _PREFIX.size <= file_size:
+        f.seek(position)
+        magic, version, length = _PREFIX.unpack(f.read(_PREFIX.size))
+        if position + _PREFIX.size + length > file_size:
+            return
+
+        if magic != MAGIC:
+            raise ValueError('{} is not a checkpoint file'.format(f.name))
+
+        if version > VERSION:
+            raise ValueError(
+                'Unsupported checkpoint version {} in {}'.format(version, f.name))
+
+        description = json.loads(f.read(length).decode('utf-8'))
+        data = position + _aligned(_PREFIX.size + length)
+        position = data + description.pop('size')
+        if position > file_size:
+            return
+
+        yield description, data, position
+
+
+def _header(specs, meta):
+    """Get header of a record of the arrays described by the list of
+    (name, dtype, shape). Returns the header and dict of the arrays offsets
+    relative to the end of the header, 'size' is the total size of the arrays.
+    """
+    description = dict(meta)
+    description['arrays'] = []
+
+    offsets = {}
+    offset = 0
+    for name, dtype, shape in specs:
+        description['arrays'].append({
+            'name': name,
+            'dtype': dtype.str,
+            'shape': list(shape),
+            'offset': offset,
+        })
+        offsets[name] = offset
+        offset = _aligned(offset + dtype.itemsize * int(numpy.prod(shape)))
+
+    description['size'] = offsets['size'] = offset
+
+    blob = json.dumps(description).encode('utf-8')
+    header_size = _PREFIX.size + len(blob)
+
+    header = _PREFIX.pack(MAGIC, VERSION, len(blob)) + blob
+    return header + bytes(_aligned(header_size) - header_size), offsets
+
+
+def _aligned(size):
+    """Round the size up to ALIGNMENT."""
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
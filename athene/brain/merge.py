@@ -0,0 +1,240 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Merging of the QLearning tables learned in different runs or on
+different machines into a single table.
+
+The saved tables are memory-mapped, only the states keys are loaded
+into memory. The union of the states is built by a merge join of the sorted
+keys and the merged Q-values are written chunk by chunk directly into
+the memory-mapped output checkpoint.
+
+To merge the tables do:
+$ python -m athene.brain.merge --output memory/merged memory/node-1 memory/node-2
+"""
+
+import os
+
+import numpy
+
+from . import checkpoint
+from .qlearning import CHECKPOINT, CHECKPOINT_DELTA
+
+
+# NOTE (alkurbatov): Ways to combine the Q-values of a state:
+# mean   - plain average of the tables.
+# visits - average weighted by the visits of each (state, action) pair,
+#          the pairs never visited are averaged as is.
+MODES = ('mean', 'visits')
+
+
+class SavedTable:
+    """Read-only view of the table saved in the specified folder:
+    the base checkpoint with the deltas applied on top of it.
+
+        Meaning of variables:
+        keys    - sorted keys of the saved states.
+        records - the checkpoint records (memory-mapped arrays).
+        sources - number of the record holding the latest row of each key.
+        rows    - number of the row in that record.
+    """
+
+    def __init__(self, src):
+        self.src = src
+
+        base = os.path.join(src, CHECKPOINT)
+        if not os.path.isfile(base):
+            raise ValueError('There is no checkpoint in {}'.format(src))
+
+        self.records = list(checkpoint.read(base))
+        self.meta = self.records[0][0]
+
+        deltas = os.path.join(src, CHECKPOINT_DELTA)
+        if os.path.isfile(deltas):
+            self.records.extend(
+                (meta, arrays) for meta, arrays in checkpoint.read(deltas)
+                if meta['generation'] == self.meta['generation']
+            )
+
+        if self.meta['encoder'] is None:
+            raise ValueError(
+                '{} is indexed by the process local states keys '
+                'and cannot be merged'.format(src))
+
+        keys = numpy.concatenate([arrays['keys'] for _, arrays in self.records])
+        sources = numpy.concatenate([
+            numpy.full(len(arrays['keys']), i, dtype=numpy.intp)
+            for i, (_, arrays) in enumerate(self.records)
+        ])
+        rows = numpy.concatenate([
+            numpy.arange(len(arrays['keys']), dtype=numpy.intp)
+            for _, arrays in self.records
+        ])
+
+        # NOTE (alkurbatov): The later records override the earlier ones,
+        # so the last occurrence of each key is taken.
+        self.keys, last = numpy.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last
+        self.sources = sources[last]
+        self.rows = rows[last]
+
+    @property
+    def actions(self):
+        """Get the saved actions."""
+        return self.meta['actions']
+
+    @property
+    def encoder(self):
+        """Get the saved state ranges."""
+        return self.meta['encoder']
+
+    @property
+    def ticks(self):
+        """Get the latest tick of the table, the deltas included."""
+        return max(meta.get('ticks', 0) for meta, _ in self.records)
+
+    def __len__(self):
+        """Get number of the saved states."""
+        return len(self.keys)
+
+    def find(self, keys):
+        """Get positions of the keys in the table and mask of the found ones."""
+        positions = numpy.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        return positions, found
+
+    def gather(self, positions, name, dtype, width):
+        """Get rows of the named array for the states at the positions.
+        Records without the array (e.g. old checkpoints without
+        statistics) give zeros.
+        """
+        sources = self.sources[positions]
+        rows = self.rows[positions]
+        gathered = numpy.zeros((len(positions), width), dtype=dtype)
+
+        for source in numpy.unique(sources).tolist():
+            arrays = self.records[source][1]
+            if name not in arrays:
+                continue
+
+            selected = sources == source
+            gathered[selected] = arrays[name][rows[selected]]
+
+        return gathered
+
+
+def merge(sources, dst, mode='mean', chunk_size=65536):
+    """Merge the tables saved in the source folders into the destination
+    folder. The tables must have the same actions and state ranges.
+    The Q-values of the states present in several tables are averaged
+    (see MODES), the visits are summed up and the excluded actions are
+    joined. Returns number of the merged states.
+    """
+    if mode not in MODES:
+        raise ValueError('Unknown merge mode {}'.format(mode))
+
+    tables = [SavedTable(src) for src in sources]
+    if not tables:
+        raise ValueError('Nothing to merge')
+
+    for table in tables[1:]:
+        if table.actions != tables[0].actions:
+            raise ValueError('{} has different actions'.format(table.src))
+
+        if table.encoder != tables[0].encoder:
+            raise ValueError('{} has different state ranges'.format(table.src))
+
+    keys = numpy.unique(numpy.concatenate([table.keys for table in tables]))
+    actions = tables[0].actions
+    masks_width = (len(actions) + 7) // 8
+
+    os.makedirs(dst, exist_ok=True)
+
+    specs = [
+        ('keys', numpy.int64, (len(keys),)),
+        ('q_values', numpy.float64, (len(keys), len(actions))),
+        ('disallowed_actions', numpy.uint8, (len(keys), masks_width)),
+        ('visits', numpy.uint32, (len(keys), len(actions))),
+        ('updated_at', numpy.uint32, (len(keys), len(actions))),
+    ]
+    meta = {
+        'actions': actions,
+        'encoder': tables[0].encoder,
+        'generation': max(table.meta['generation'] for table in tables) + 1,
+        'ticks': max(table.ticks for table in tables),
+    }
+
+    with checkpoint.create(os.path.join(dst, CHECKPOINT), specs, **meta) as merged:
+        merged['keys'][:] = keys
+
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+
+            shape = (len(chunk), len(actions))
+            values = numpy.zeros(shape, dtype=numpy.float64)
+            counts = numpy.zeros(shape, dtype=numpy.float64)
+            weighted = numpy.zeros(shape, dtype=numpy.float64)
+            visits = numpy.zeros(shape, dtype=numpy.uint64)
+            updated_at = numpy.zeros(shape, dtype=numpy.uint32)
+            masks = numpy.zeros((len(chunk), masks_width), dtype=numpy.uint8)
+
+            for table in tables:
+                positions, found = table.find(chunk)
+                positions = positions[found]
+
+                q_values = table.gather(
+                    positions, 'q_values', numpy.float64, len(actions))
+                table_visits = table.gather(
+                    positions, 'visits', numpy.uint32, len(actions))
+
+                values[found] += q_values
+                counts[found] += 1
+                weighted[found] += q_values * table_visits
+                visits[found] += table_visits
+
+                updated_at[found] = numpy.maximum(updated_at[found], table.gather(
+                    positions, 'updated_at', numpy.uint32, len(actions)))
+
+                # NOTE (alkurbatov): The masks are bit-packed with the same
+                # layout, so they could be joined bytewise.
+                masks[found] |= table.gather(
+                    positions, 'disallowed_actions', numpy.uint8, masks_width)
+
+            values /= numpy.maximum(counts, 1)
+            if mode == 'visits':
+                visited = visits > 0
+                values[visited] = weighted[visited] / visits[visited]
+
+            rows = slice(start, start + len(chunk))
+            merged['q_values'][rows] = values
+            merged['visits'][rows] = numpy.minimum(visits, numpy.iinfo(numpy.uint32).max)
+            merged['updated_at'][rows] = updated_at
+            merged['disallowed_actions'][rows] = masks
+
+    deltas = os.path.join(dst, CHECKPOINT_DELTA)
+    if os.path.isfile(deltas):
+        os.remove(deltas)
+
+    return len(keys)
+
+
+def main(argv):
+    from absl.flags import FLAGS
+
+    sources = argv[1:]
+    count = merge(sources, FLAGS.output, mode=FLAGS.mode, chunk_size=FLAGS.chunk_size)
+    print('[INFO] Merged {} tables into {} states'.format(len(sources), count))
+
+
+if __name__ == '__main__':
+    from absl import app
+    from absl import flags
+
+    flags.DEFINE_string('output', None, 'Folder to save the merged table to.')
+    flags.DEFINE_enum('mode', 'mean', MODES, 'How to combine the Q-values.')
+    flags.DEFINE_integer('chunk_size', 65536, 'Number of states merged at once.')
+    flags.mark_flag_as_required('output')
+
+    app.run(main)
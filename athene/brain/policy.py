@@ -0,0 +1,197 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Frozen greedy policy of a trained QLearning table, used to play
+and evaluate the table without the learning overhead.
+
+To evaluate the table over the states remembered by the experience replay do:
+$ python -m athene.brain.policy memory/collect_minerals_and_gas
+"""
+
+import os
+
+import numpy
+
+from .qlearning import QLearningTable
+from .replay import REPLAY
+from .states import StateEncoder
+
+
+class GreedyPolicy:
+    """Read-only copy of the QLearning table keeping only what is needed to
+    act greedily: the sorted states keys and the actions of each state ranked
+    by their Q-values, the disallowed actions go last. The states are never
+    registered and no random numbers are drawn, unknown states get
+    the default action.
+
+        Meaning of variables:
+        default - action chosen in the unknown states and in the states
+                  where all actions are excluded, the first action
+                  of the table by default.
+    """
+
+    # NOTE (alkurbatov): Largest state space looked up through a dense array
+    # of rows indexed by the states keys, larger ones use a dictionary.
+    DENSE_LIMIT = 1 << 20
+
+    def __init__(self, qlearn, default=None):
+        self.actions = list(qlearn.actions)
+        self.encoder = qlearn.encoder
+        self.default = self.actions[0] if default is None else default
+
+        columns = qlearn.columns()
+        order = numpy.argsort(columns['keys'], kind='stable')
+        self.keys = columns['keys'][order]
+
+        disallowed = columns['disallowed_actions'][order]
+        values = numpy.where(disallowed, -numpy.inf, columns['q_values'][order])
+
+        self.ranking = numpy.argsort(-values, axis=1, kind='stable').astype(numpy.int16)
+        self.allowed = ~disallowed
+
+        # NOTE (alkurbatov): -1 marks the states where all actions
+        # are disallowed, such states have no value.
+        self.greedy = numpy.where(
+            self.allowed.any(axis=1), self.ranking[:, 0], -1).astype(numpy.int16)
+        self.values = numpy.where(
+            self.greedy >= 0,
+            values[numpy.arange(len(self.keys)), numpy.maximum(self.greedy, 0)],
+            numpy.nan
+        )
+
+        self.rows = None
+        self.lookup = None
+        dense = isinstance(self.encoder, StateEncoder) and \
+            self.encoder.size <= self.DENSE_LIMIT
+        if dense:
+            self.rows = numpy.full(self.encoder.size, -1, dtype=numpy.int64)
+            self.rows[self.keys] = numpy.arange(len(self.keys))
+        else:
+            self.lookup = dict(zip(self.keys.tolist(), range(len(self.keys))))
+
+    def __len__(self):
+        """Get number of the known states."""
+        return len(self.keys)
+
+    @staticmethod
+    def load(actions, src, encoder=None, default=None):
+        """Initialize the policy from the table saved in the specified folder."""
+        return GreedyPolicy(
+            QLearningTable.load(actions, src, encoder=encoder), default=default)
+
+    def choose_action(self, current_state, excluded_actions=None):
+        """Choose the best action in the state. The excluded actions could be
+        passed either as a set of actions or as a boolean mask aligned with
+        the table actions.
+        """
+        row = self.find(current_state)
+        if row < 0:
+            return self.default
+
+        if excluded_actions is None:
+            action = self.greedy[row]
+            return self.actions[action] if action >= 0 else self.default
+
+        allowed = self.allowed[row] & ~self._mask(excluded_actions)
+        candidates = self.ranking[row][allowed[self.ranking[row]]]
+        return self.actions[candidates[0]] if len(candidates) else self.default
+
+    def find(self, state):
+        """Get row of the state, -1 for the unknown states."""
+        if isinstance(self.encoder, StateEncoder):
+            key = self.encoder.encode(state)
+        else:
+            # NOTE (alkurbatov): The states index registers new states.
+            key = self.encoder.keys.get(state, -1)
+
+        if self.rows is not None:
+            return int(self.rows[key])
+
+        return self.lookup.get(key, -1)
+
+    def evaluate(self, states, actions=None, encoded=False):
+        """Score the policy over the logged states and, optionally,
+        the actions taken in them (names or ids of the table actions).
+        Returns dictionary with number of the states, part of the known
+        states (coverage), part of the logged actions matching the greedy
+        ones (agreement) and mean Q-value of the greedy actions.
+        """
+        if encoded:
+            keys = numpy.asarray(states, dtype=numpy.int64)
+        elif isinstance(self.encoder, StateEncoder):
+            keys = numpy.array(
+                [self.encoder.encode(state) for state in states], dtype=numpy.int64)
+        else:
+            keys = numpy.array(
+                [self.encoder.keys.get(state, -1) for state in states], dtype=numpy.int64)
+
+        rows = numpy.searchsorted(self.keys, keys)
+        found = rows < len(self.keys)
+        found[found] = self.keys[rows[found]] == keys[found]
+        rows = rows[found]
+        values = self.values[rows]
+        values = values[~numpy.isnan(values)]
+
+        report = {
+            'states': len(keys),
+            'coverage': float(found.mean()) if len(keys) else 0.0,
+            'agreement': None,
+            'mean_value': float(values.mean()) if len(values) else 0.0,
+        }
+
+        if actions is not None:
+            actions = numpy.asarray(actions)
+            if actions.dtype.kind not in 'iu':
+                actions = numpy.array([self.actions.index(action) for action in actions])
+
+            matched = self.greedy[rows] == actions[found]
+            report['agreement'] = float(matched.mean()) if len(rows) else 0.0
+
+        return report
+
+    def _mask(self, excluded_actions):
+        """Convert a set of excluded actions to a boolean mask."""
+        if isinstance(excluded_actions, numpy.ndarray):
+            return excluded_actions
+
+        mask = numpy.zeros(len(self.actions), dtype=numpy.bool_)
+        for action in excluded_actions:
+            mask[self.actions.index(action)] = True
+
+        return mask
+
+
+def main(argv):
+    from absl.flags import FLAGS
+
+    from athene.brain.merge import SavedTable
+
+    for src in argv[1:]:
+        saved = SavedTable(src)
+        policy = GreedyPolicy.load(
+            saved.actions, src,
+            encoder=StateEncoder(saved.encoder),
+            default=FLAGS.default,
+        )
+
+        path = os.path.join(src, REPLAY)
+        if not os.path.isfile(path):
+            print('[WARNING] There are no remembered states in {}'.format(src))
+            continue
+
+        with numpy.load(path) as replay:
+            report = policy.evaluate(replay['states'], replay['actions'], encoded=True)
+
+        print('[INFO] {}: {} states, coverage {:.3f}, agreement {:.3f}, '
+              'mean value {:.4f}'.format(src, report['states'], report['coverage'],
+                                         report['agreement'], report['mean_value']))
+
+
+if __name__ == '__main__':
+    from absl import app
+    from absl import flags
+
+    flags.DEFINE_string('default', None, 'Action chosen in the unknown states.')
+
+    app.run(main)
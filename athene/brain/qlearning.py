@@ -4,11 +4,28 @@
 
 """My implementation of the QLearning table."""
 
+import ast
 import os
+import pickle
+import random
 import shutil
 
 import numpy
-import pandas
+
+from . import checkpoint
+from .spill import SpillStore
+from .states import TERMINAL, TERMINAL_KEY, StateEncoder, StateIndex
+
+
+CHECKPOINT = 'qlearn.bin'
+CHECKPOINT_DELTA = 'qlearn.delta'
+
+# NOTE (alkurbatov): Policies choosing the states to evict from
+# the memory-bounded table:
+# lru - the least recently used states go first.
+# lfu - the least visited states go first, the least recently used
+#       ones among equally visited.
+EVICTION = ('lru', 'lfu')
 
 
 class QLearningTable:
@@ -22,44 +39,215 @@ class QLearningTable:
                   more about the long term reward.
         epsilon - the exploration rate aka the greedy policy factor.
                   The exploration means finding more about the environment.
+        alpha_decay   - decay of the learning rate by the number of visits
+                        of the (state, action) pair:
+                        alpha / (1 + alpha_decay * visits).
+        epsilon_decay - decay of the exploration by the number of visits
+                        of the state, the chance to explore is
+                        (1 - epsilon) / (1 + epsilon_decay * visits).
+                        Both decays are off by default.
+        max_states    - maximal number of the states kept in memory,
+                        unbounded by default.
+        eviction      - policy choosing the states to evict, see EVICTION.
+        spill         - path of the file keeping the evicted states,
+                        a temporary file by default.
+
+        The Q-values are kept in a contiguous numpy array, one row per state
+        and one column per action. States are turned into integer keys by
+        the encoder (see athene.brain.states), the keys are mapped to the row
+        ids through a dictionary and the array doubles its capacity when
+        it is full, so registration of a new state costs amortized O(1).
+        Each (state, action) pair also has a visits counter and the tick
+        (number of the learning step) of its last update.
+
+        In the bounded mode the cold states are evicted to the memory-mapped
+        spill store (see athene.brain.spill) and paged back in on demand.
+        The hits and misses counters tell how often the used states were
+        found in memory and in the spill store.
     """
 
-    def __init__(self, actions, alpha=0.01, gamma=0.9, epsilon=0.9):
-        self.disallowed_actions = {}
+    INITIAL_CAPACITY = 1024
+
+    # NOTE (alkurbatov): Number of delta dumps after which the deltas
+    # are compacted into the base checkpoint.
+    COMPACT_EVERY = 50
+
+    # NOTE (alkurbatov): Part of max_states evicted in addition to the needed
+    # states, so the eviction runs once per many new states.
+    EVICT_BATCH = 64
+
+    # NOTE (alkurbatov): Arrays holding a row per state.
+    ROW_ARRAYS = ('keys', 'dirty', 'q_values', 'disallowed_actions',
+                  'visits', 'updated_at', 'used_at')
+
+    def __init__(self, actions, alpha=0.01, gamma=0.9, epsilon=0.9, encoder=None,
+                 alpha_decay=0.0, epsilon_decay=0.0, max_states=None,
+                 eviction='lru', spill=None):
+        if eviction not in EVICTION:
+            raise ValueError('Unknown eviction policy {}'.format(eviction))
+
+        self.encoder = encoder if encoder is not None else StateIndex()
         self.alpha = alpha
         self.gamma = gamma
         self.epsilon = epsilon
-        self.q_table = pandas.DataFrame(columns=actions, dtype=numpy.float64)
+        self.alpha_decay = alpha_decay
+        self.epsilon_decay = epsilon_decay
 
-    def choose_action(self, current_state, excluded_actions=None):
-        """Choose the next action based on the current state."""
-        current_state = str(current_state)
-        self._register_state(current_state)
+        self.actions = list(actions)
+        self.action_ids = {action: i for i, action in enumerate(self.actions)}
+
+        self.states = {}
+        self.keys = numpy.zeros(self.INITIAL_CAPACITY, dtype=numpy.int64)
+        self.q_values = numpy.zeros(
+            (self.INITIAL_CAPACITY, len(self.actions)),
+            dtype=numpy.float64
+        )
+
+        # NOTE (alkurbatov): Actions excluded in a state, one row per state
+        # aligned with the Q-values. The memory is bounded by the table size.
+        self.disallowed_actions = numpy.zeros(
+            (self.INITIAL_CAPACITY, len(self.actions)),
+            dtype=numpy.bool_
+        )
+
+        # NOTE (alkurbatov): Statistics of the (state, action) pairs.
+        self.visits = numpy.zeros(
+            (self.INITIAL_CAPACITY, len(self.actions)),
+            dtype=numpy.uint32
+        )
+        self.updated_at = numpy.zeros(
+            (self.INITIAL_CAPACITY, len(self.actions)),
+            dtype=numpy.uint32
+        )
+        self.ticks = 0
+
+        # NOTE (alkurbatov): Rows changed since the last dump.
+        self.dirty = numpy.zeros(self.INITIAL_CAPACITY, dtype=numpy.bool_)
+        self.deltas = 0
+        self.generation = 0
+
+        # NOTE (alkurbatov): Number of the exploratory choices.
+        self.explorations = 0
 
-        state_actions = self.q_table.loc[current_state, :]
+        # NOTE (alkurbatov): Clock of the last use of each row
+        # and the memory-bounded mode.
+        self.used_at = numpy.zeros(self.INITIAL_CAPACITY, dtype=numpy.int64)
+        self.clock = 0
+        self.max_states = max_states
+        self.eviction = eviction
+        self.spill = None
+        if max_states is not None:
+            self.spill = SpillStore(len(self.actions), spill)
 
-        if excluded_actions:
-            self.disallowed_actions[current_state] = excluded_actions
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
+        # NOTE (alkurbatov): Preallocated buffers for the hot paths.
+        self._values = numpy.empty(len(self.actions), dtype=numpy.float64)
+        self._flags = numpy.empty(len(self.actions), dtype=numpy.bool_)
+        self._mask = numpy.zeros(len(self.actions), dtype=numpy.bool_)
+
+    def __len__(self):
+        """Get number of the states kept in memory."""
+        return len(self.states)
+
+    @property
+    def size(self):
+        """Get number of the registered states including the evicted ones."""
+        return len(self) + (len(self.spill) if self.spill is not None else 0)
+
+    @property
+    def q_table(self):
+        """Get a copy of the table as pandas.DataFrame indexed by states.
+        Slow, use it for inspection and export only. The evicted states
+        are not included.
+        """
+        # NOTE (alkurbatov): pandas takes a while to import and is not needed
+        # for learning, so it is loaded only here and for the old dumps.
+        import pandas
+
+        states = self.encoder.decode_many(self.keys[:len(self)])
+        if self.encoder.names:
+            index = pandas.MultiIndex.from_arrays(
+                list(numpy.asarray(states).T), names=self.encoder.names)
+        else:
+            if isinstance(states, numpy.ndarray):
+                states = [tuple(state) for state in states.tolist()]
+
+            index = pandas.Index(states, tupleize_cols=False)
+
+        return pandas.DataFrame(
+            self.q_values[:len(self)],
+            index=index,
+            columns=self.actions
+        )
+
+    def encode(self, state):
+        """Get the integer key of the state."""
+        return self.encoder.encode(state)
+
+    def decode(self, key):
+        """Get the state packed into the integer key."""
+        return self.encoder.decode(key)
+
+    def choose_action(self, current_state, excluded_actions=None):
+        """Choose the next action based on the current state.
+        The excluded actions could be passed either as a set of actions
+        or as a boolean mask aligned with the table actions. If nothing is
+        excluded, all the actions are allowed whatever was excluded
+        in the state before.
+        """
+        key = self.encoder.encode(current_state)
+        self._make_room((key,))
+        row = self._register_state(key)
+
+        if excluded_actions is not None:
             # NOTE (alkurbatov): Filter excluded actions from
             # the possible choices, so the agent will not take
             # an invalid action.
-            items = set(self.q_table.columns) - excluded_actions
-            state_actions = state_actions.filter(items=items)
+            self.disallowed_actions[row] = self.action_mask(excluded_actions)
+            self.dirty[row] = True
+
+        greedy = self.epsilon
+        if self.epsilon_decay:
+            visits = int(self.visits[row].sum())
+            greedy = 1 - (1 - self.epsilon) / (1 + self.epsilon_decay * visits)
 
-        if numpy.random.uniform() < self.epsilon:
+        if random.random() < greedy:
             # NOTE (alkurbatov): Try to choose the best action
             # available in the current state.
             # Some actions could have equal weights, select random one
             # in this case.
-            state_actions = state_actions.reindex(
-                numpy.random.permutation(state_actions.index))
-            action = state_actions.idxmax()
+            if excluded_actions is None:
+                values = self.q_values[row]
+            else:
+                values = self._masked_values(row)
+
+            numpy.equal(values, values.max(), out=self._flags)
         else:
             # NOTE (alkurbatov): Time for exploration.
-            action = numpy.random.choice(state_actions.index)
+            self.explorations += 1
+            if excluded_actions is None:
+                self._flags.fill(True)
+            else:
+                numpy.logical_not(self.disallowed_actions[row], out=self._flags)
+
+        return self.actions[self._random_flag()]
+
+    def action_mask(self, excluded_actions):
+        """Convert a set of excluded actions to a boolean mask aligned with
+        the table actions. Masks are returned as is.
+        """
+        if isinstance(excluded_actions, numpy.ndarray):
+            return excluded_actions
+
+        mask = self._mask
+        mask.fill(False)
+        for action in excluded_actions:
+            mask[self.action_ids[action]] = True
 
-        return action
+        return mask
 
     def learn(self, s, a, r, s_):
         """Learn using the Qlearning algorithm.
@@ -70,69 +258,572 @@ class QLearningTable:
             r - a reward received after the execution of the previous action.
             s_ - a next state.
         """
-        s = str(s)
-        s_ = str(s_)
+        s = self.encoder.encode(s)
+        s_ = TERMINAL if s_ == TERMINAL else self.encoder.encode(s_)
 
         if s == s_:
             # NOTE (alkurbatov): No changes in the state, nothing to learn.
             return
 
-        self._register_state(s_)
+        self._make_room((s,) if s_ == TERMINAL else (s, s_))
+        row = self._register_state(s)
+        action = self.action_ids[a]
 
-        q_predict = self.q_table.loc[s, a]
+        q_predict = self.q_values[row, action]
 
-        if s_ == 'terminal':
+        if s_ == TERMINAL:
             # NOTE (alkurbatov): The current state is terminal
             # which means end of the episode. The reward applied at this step
             # is sparse reward.
             q_target = r
         else:
-            rewards = self.q_table.loc[s_, :]
-
-            if s_ in self.disallowed_actions:
-                # NOTE (alkurbatov): Since the invalid actions never get
-                # chosen, their rewards never change. If they start at 0
-                # then they could become the highest value action
-                # for that state if all other actions have negative values.
-                # To get around this, we filter the invalid actions from
-                # the next state’s rewards.
-                items = set(self.q_table.columns) - self.disallowed_actions[s_]
-                rewards = rewards.filter(items=items)
-
+            # NOTE (alkurbatov): Since the invalid actions never get
+            # chosen, their rewards never change. If they start at 0
+            # then they could become the highest value action
+            # for that state if all other actions have negative values.
+            # To get around this, we filter the invalid actions from
+            # the next state’s rewards.
+            rewards = self._masked_values(self._register_state(s_))
             q_target = r + self.gamma * rewards.max()
 
-        self.q_table.loc[s, a] += self.alpha * (q_target - q_predict)
+        alpha = self.alpha
+        if self.alpha_decay:
+            alpha /= 1 + self.alpha_decay * int(self.visits[row, action])
 
-    @staticmethod
-    def load(actions, src, reset=False):
-        """Initialize Qtable from the specified folder."""
-        q_learn = QLearningTable(actions)
+        self.q_values[row, action] += alpha * (q_target - q_predict)
+        self.ticks += 1
+        self.visits[row, action] += 1
+        self.updated_at[row, action] = self.ticks
+        self.dirty[row] = True
+
+    def learn_batch(self, s, a, r, s_, epochs=1, encoded=False):
+        """Learn from a batch of transitions using vectorized updates.
+        The result is identical to calling learn() for each transition
+        in order, the batch is replayed the specified number of epochs.
+        Returns the temporal difference errors of the last epoch.
+
+            Meaning of variables:
+            s - previous states.
+            a - previous actions, names or ids of the table actions.
+            r - rewards received after the execution of the actions.
+            s_ - next states, TERMINAL marks end of the episode.
+            encoded - the states are passed as integer keys already,
+                      TERMINAL_KEY marks end of the episode.
+        """
+        rewards = numpy.asarray(r, dtype=numpy.float64)
+        actions = numpy.asarray(a)
+        if actions.dtype.kind not in 'iu':
+            actions = numpy.array([self.action_ids[action] for action in a])
+
+        rows = numpy.zeros(len(rewards), dtype=numpy.intp)
+        next_rows = numpy.zeros(len(rewards), dtype=numpy.intp)
+        terminal = numpy.zeros(len(rewards), dtype=numpy.bool_)
+        transitions = []
+
+        for i, (state, next_state) in enumerate(zip(s, s_)):
+            if encoded:
+                state = int(state)
+                next_state = int(next_state)
+                terminal[i] = next_state == TERMINAL_KEY
+            else:
+                state = self.encoder.encode(state)
+                terminal[i] = next_state == TERMINAL
+                if not terminal[i]:
+                    next_state = self.encoder.encode(next_state)
+
+            if not terminal[i] and state == next_state:
+                # NOTE (alkurbatov): No changes in the state, nothing to learn.
+                continue
+
+            transitions.append((i, state, next_state))
+
+        # NOTE (alkurbatov): The rows must stay in place until the batch
+        # is learned, so the room is made for all the states at once.
+        self._make_room(
+            [state for _, state, _ in transitions] +
+            [next_state for i, _, next_state in transitions if not terminal[i]])
+
+        for i, state, next_state in transitions:
+            rows[i] = self._register_state(state)
+            if not terminal[i]:
+                next_rows[i] = self._register_state(next_state)
+
+        active = [i for i, _, _ in transitions]
+        segments = self._independent_segments(
+            numpy.array(active, dtype=numpy.intp), rows, next_rows, terminal)
+
+        errors = numpy.zeros(len(rewards), dtype=numpy.float64)
+        for _ in range(epochs):
+            for batch in segments:
+                errors[batch] = self._learn_rows(
+                    rows[batch], actions[batch], rewards[batch],
+                    next_rows[batch], terminal[batch])
+
+        return errors
+
+    def prune(self, min_visits=1, max_states=None):
+        """Forget the states visited less than min_visits times and, if
+        max_states is specified, the least visited states above that limit
+        (the least recently updated ones go first among equally visited).
+        Returns number of the removed states. The next dump
+        rewrites the base checkpoint, so the states are removed there too.
+        Only the states kept in memory are considered, the evicted ones
+        are never pruned.
+        """
+        count = len(self)
+        visits = self.visits[:count].sum(axis=1, dtype=numpy.uint64)
+        keep = visits >= min_visits
+
+        if max_states is not None and keep.sum() > max_states:
+            updated_at = self.updated_at[:count].max(axis=1)
+            order = numpy.lexsort((updated_at, visits))
+            keep[order[:count - max_states]] = False
+
+        rows = keep.nonzero()[0]
+        if len(rows) == count:
+            return 0
+
+        for name in self.ROW_ARRAYS:
+            array = getattr(self, name)
+            array[:len(rows)] = array[rows]
+            array[len(rows):count] = 0
+
+        self.states = {key: row for row, key in enumerate(self.keys[:len(rows)].tolist())}
 
+        # NOTE (alkurbatov): The deltas can't remove the states.
+        self.deltas = self.COMPACT_EVERY
+        return count - len(rows)
+
+    def update_masks(self, keys, masks):
+        """Set the excluded actions of the states given by integer keys.
+        The masks are aligned with the table actions, later masks of
+        the same state override the earlier ones.
+        """
+        keys = [int(key) for key in keys]
+        self._make_room(keys)
+
+        for key, mask in zip(keys, masks):
+            row = self._register_state(key)
+            self.disallowed_actions[row] = mask
+            self.dirty[row] = True
+
+    @staticmethod
+    def load(actions, src, reset=False, encoder=None, **kwargs):
+        """Initialize Qtable from the specified folder.
+        The binary checkpoint is memory-mapped and the saved deltas
+        are applied on top of it. Old pickled dumps are loaded if there is
+        no checkpoint yet. The keyword arguments are passed to the constructor.
+        """
         if os.path.isdir(src) and reset:
             shutil.rmtree(src)
 
         os.makedirs(src, exist_ok=True)
 
+        q_learn = QLearningTable(actions, encoder=encoder, **kwargs)
+
+        base = os.path.join(src, CHECKPOINT)
+        deltas = os.path.join(src, CHECKPOINT_DELTA)
         data_dump = os.path.join(src, 'qlearn.gz')
-        if os.path.isfile(data_dump):
-            q_learn.q_table = pandas.read_pickle(data_dump, compression='gzip')
+
+        if os.path.isfile(base):
+            for meta, arrays in checkpoint.read(base):
+                q_learn.load_record(meta, arrays)
+                q_learn.generation = meta['generation']
+
+            if os.path.isfile(deltas):
+                for meta, arrays in checkpoint.read(deltas):
+                    # NOTE (alkurbatov): Skip the deltas left from the previous
+                    # base checkpoint if we crashed before removing them.
+                    if meta['generation'] != q_learn.generation:
+                        continue
+
+                    q_learn.load_record(meta, arrays)
+                    q_learn.deltas += 1
+
+            q_learn.dirty.fill(False)
+            if q_learn.spill is not None:
+                q_learn.spill.clear_dirty()
+
+        elif os.path.isfile(data_dump):
+            import pandas
+            q_learn.load_frame(pandas.read_pickle(data_dump, compression='gzip'))
 
         return q_learn
 
-    def dump(self, dst):
-        """Dump Qtable to the specified folder."""
-        self.q_table.to_pickle(os.path.join(dst, 'qlearn.gz'), 'gzip')
+    def load_frame(self, frame):
+        """Fill the table from pandas.DataFrame, e.g. the old dumps.
+        Columns not listed in the table actions are ignored.
+        """
+        frame = frame.reindex(columns=self.actions, fill_value=0)
+
+        keys = [self.encoder.encode(_parse_state(state)) for state in frame.index]
+        values = frame.values.astype(numpy.float64)
+
+        for chunk in self._chunks(len(keys)):
+            self._make_room(keys[chunk])
+            rows = [self._register_state(key) for key in keys[chunk]]
+            self.q_values[rows] = values[chunk]
+
+    def load_record(self, meta, arrays):
+        """Fill the table from a checkpoint record.
+        Saved actions not listed in the table actions are ignored, the states
+        are re-encoded if the saved state ranges differ.
+        """
+        if 'pickled_states' in arrays:
+            states = pickle.loads(arrays['pickled_states'].tobytes())
+            keys = [self.encoder.encode(state) for state in states]
+        elif 'states' in arrays:
+            # NOTE (alkurbatov): Older checkpoints kept the states
+            # as rows of integers.
+            keys = [
+                self.encoder.encode(tuple(state)) for state in arrays['states'].tolist()
+            ]
+        elif meta['encoder'] and StateEncoder(meta['encoder']) != self.encoder:
+            saved = StateEncoder(meta['encoder'])
+            keys = [
+                self.encoder.encode(state) for state in saved.decode_many(arrays['keys'])
+            ]
+        else:
+            keys = arrays['keys'].tolist()
+
+        saved_actions = meta['actions']
+        masks = numpy.unpackbits(
+            arrays['disallowed_actions'], axis=1, count=len(saved_actions)
+        ).astype(numpy.bool_)
+
+        # NOTE (alkurbatov): Old checkpoints have no statistics.
+        self.ticks = max(self.ticks, meta.get('ticks', 0))
+        columns = {'q_values': arrays['q_values'], 'disallowed_actions': masks}
+        for name in ('visits', 'updated_at'):
+            if name in arrays:
+                columns[name] = arrays[name]
+
+        mapping = [
+            (column, self.action_ids[action])
+            for column, action in enumerate(saved_actions) if action in self.action_ids
+        ]
+
+        # NOTE (alkurbatov): The bounded table could hold only a part
+        # of the record at once, the rest is evicted to the spill store.
+        for chunk in self._chunks(len(keys)):
+            self._make_room(keys[chunk])
+            rows = numpy.array(
+                [self._register_state(key) for key in keys[chunk]], dtype=numpy.intp)
+
+            if saved_actions == self.actions:
+                for name, values in columns.items():
+                    getattr(self, name)[rows] = values[chunk]
+
+                continue
+
+            for column, i in mapping:
+                for name, values in columns.items():
+                    getattr(self, name)[rows, i] = values[chunk, column]
+
+    def dump(self, dst, delta=False):
+        """Dump Qtable to the specified folder.
+        In the delta mode only the rows changed since the previous dump are
+        appended to the delta file. The deltas are compacted into the base
+        checkpoint every COMPACT_EVERY dumps.
+        """
+        self.snapshot(dst, delta=delta).write()
+
+    def snapshot(self, dst, delta=False):
+        """Copy the data to be dumped to the specified folder, see dump().
+        The snapshot doesn't share memory with the table, so it could be
+        written from another thread while the table keeps learning.
+        The evicted states are saved too.
+        """
+        spilled = None
+
+        if delta and self.deltas < self.COMPACT_EVERY and \
+           os.path.isfile(os.path.join(dst, CHECKPOINT)):
+            rows = self.dirty[:len(self)].nonzero()[0]
+            if self.spill is not None:
+                spilled = self.spill.columns(dirty_only=True)
+
+            self.deltas += 1
+        else:
+            rows = numpy.arange(len(self))
+            if self.spill is not None:
+                spilled = self.spill.columns()
+                self.spill.clear_dirty()
+
+            self.generation += 1
+            self.deltas = 0
+            delta = False
+
+        self.dirty.fill(False)
+        return Snapshot(dst, self.record_arrays(rows, spilled), self.record_meta(), delta)
+
+    def export_csv(self, dst):
+        """Export Qtable to .CSV file in the specified folder."""
         self.q_table.to_csv(os.path.join(dst, 'qlearn.csv'))
 
-    def _register_state(self, current_state):
-        """If the current state doesn't exist in QTable, add it."""
-        if current_state in self.q_table.index:
+    def record_meta(self):
+        """Get metadata of the checkpoint record."""
+        encoder = None
+        if isinstance(self.encoder, StateEncoder):
+            encoder = list(self.encoder.ranges)
+
+        return {
+            'actions': self.actions,
+            'encoder': encoder,
+            'generation': self.generation,
+            'ticks': self.ticks,
+        }
+
+    def columns(self, rows=None, spilled=None):
+        """Get copies of the specified rows and of the evicted states given
+        as columns of the spill store, or of the whole table including
+        the evicted states. Returns dictionary of arrays.
+        """
+        if rows is None:
+            rows = numpy.arange(len(self))
+            if self.spill is not None:
+                spilled = self.spill.columns()
+
+        columns = {
+            'keys': self.keys[rows],
+            'q_values': self.q_values[rows],
+            'disallowed_actions': self.disallowed_actions[rows],
+            'visits': self.visits[rows],
+            'updated_at': self.updated_at[rows],
+        }
+
+        if spilled is not None and len(spilled['keys']):
+            for name, values in columns.items():
+                columns[name] = numpy.concatenate((values, spilled[name]))
+
+        return columns
+
+    def record_arrays(self, rows=None, spilled=None):
+        """Get arrays of the checkpoint record, see columns()."""
+        arrays = self.columns(rows, spilled)
+        arrays['disallowed_actions'] = numpy.packbits(
+            arrays['disallowed_actions'], axis=1)
+
+        if not isinstance(self.encoder, StateEncoder):
+            # NOTE (alkurbatov): The keys of the states index have no meaning
+            # outside of the process, save the states themselves. The states
+            # could be of any hashable type, so they are pickled.
+            states = self.encoder.decode_many(arrays['keys'].tolist())
+            arrays['pickled_states'] = numpy.frombuffer(
+                pickle.dumps(states), dtype=numpy.uint8)
+
+        return arrays
+
+    @staticmethod
+    def _independent_segments(active, rows, next_rows, terminal):
+        """Split the transitions into consecutive segments where no transition
+        reads a row updated by a previous transition of the same segment,
+        so each segment could be applied at once.
+        """
+        segments = []
+        start = 0
+        updated = set()
+
+        for i, transition in enumerate(active):
+            if rows[transition] in updated or \
+               (not terminal[transition] and next_rows[transition] in updated):
+                segments.append(active[start:i])
+                start = i
+                updated.clear()
+
+            updated.add(rows[transition])
+
+        if start < len(active):
+            segments.append(active[start:])
+
+        return segments
+
+    def _learn_rows(self, rows, actions, rewards, next_rows, terminal):
+        """Apply the Qlearning update to independent transitions at once.
+        Returns the temporal difference errors.
+        """
+        q_predict = self.q_values[rows, actions]
+
+        rewards_ = numpy.where(
+            self.disallowed_actions[next_rows], -numpy.inf, self.q_values[next_rows])
+        q_target = numpy.where(
+            terminal, rewards, rewards + self.gamma * rewards_.max(axis=1))
+
+        alpha = self.alpha
+        if self.alpha_decay:
+            alpha = alpha / (1 + self.alpha_decay * self.visits[rows, actions])
+
+        errors = q_target - q_predict
+        self.q_values[rows, actions] += alpha * errors
+
+        # NOTE (alkurbatov): Ticks of the transitions as if they were
+        # learned one by one.
+        self.visits[rows, actions] += 1
+        self.updated_at[rows, actions] = self.ticks + numpy.arange(1, len(rows) + 1)
+        self.ticks += len(rows)
+
+        self.dirty[rows] = True
+        return errors
+
+    def _masked_values(self, row):
+        """Get Q-values of the specified row with the disallowed actions
+        replaced by -inf. Returns the preallocated buffer.
+        """
+        numpy.copyto(self._values, self.q_values[row])
+        numpy.copyto(self._values, -numpy.inf, where=self.disallowed_actions[row])
+        return self._values
+
+    def _random_flag(self):
+        """Get index of a random raised flag from the flags buffer."""
+        candidates = self._flags.nonzero()[0]
+        return int(candidates[random.randrange(len(candidates))])
+
+    def _register_state(self, key):
+        """If the state key doesn't exist in QTable, add it or page it in
+        from the spill store. Returns id of the state's row.
+        """
+        self.clock += 1
+
+        row = self.states.get(key)
+        if row is not None:
+            self.hits += 1
+            self.used_at[row] = self.clock
+            return row
+
+        row = len(self.states)
+        if row == len(self.q_values):
+            self._grow()
+
+        self.states[key] = row
+        self.keys[row] = key
+        self.dirty[row] = True
+        self.used_at[row] = self.clock
+
+        if self.spill is not None and key in self.spill:
+            record = self.spill.take(key)
+            for name in ('dirty', 'q_values', 'disallowed_actions', 'visits',
+                         'updated_at'):
+                getattr(self, name)[row] = record[name]
+
+            self.misses += 1
+
+        return row
+
+    def _chunks(self, count):
+        """Split number of the states registered at once into slices
+        fitting into the bounded table.
+        """
+        size = max(self.max_states or count, 1)
+        return [slice(start, start + size) for start in range(0, count, size)]
+
+    def _make_room(self, keys):
+        """Evict the cold states, so the states given by the keys could be
+        registered without exceeding max_states. The states of the keys
+        are never evicted, the table exceeds the limit if they don't fit.
+        Must be called before the rows of the operation are taken.
+        """
+        if self.max_states is None:
             return
 
-        self.q_table = self.q_table.append(
-            pandas.Series(
-                [0] * len(self.q_table.columns),
-                index=self.q_table.columns,
-                name=current_state
-            )
-        )
+        keys = set(keys)
+        resident = [self.states[key] for key in keys if key in self.states]
+
+        excess = len(self) + len(keys) - len(resident) - self.max_states
+        if excess <= 0:
+            return
+
+        excess = min(
+            excess + self.max_states // self.EVICT_BATCH, len(self) - len(resident))
+        if excess <= 0:
+            return
+
+        count = len(self)
+        if self.eviction == 'lfu':
+            visits = self.visits[:count].sum(axis=1, dtype=numpy.uint64)
+            order = numpy.lexsort((self.used_at[:count], visits))
+        else:
+            order = numpy.argsort(self.used_at[:count], kind='stable')
+
+        protected = numpy.zeros(count, dtype=numpy.bool_)
+        protected[resident] = True
+        self._evict(order[~protected[order]][:excess])
+
+    def _evict(self, rows):
+        """Move the rows to the spill store. The rows left are compacted
+        by moving the last rows into the freed ones.
+        """
+        count = len(self)
+        rows = numpy.sort(rows)
+
+        self.spill.put({
+            name: getattr(self, name)[rows]
+            for name in ('keys', 'dirty', 'q_values', 'disallowed_actions', 'visits',
+                         'updated_at')
+        })
+
+        for key in self.keys[rows].tolist():
+            del self.states[key]
+
+        kept = count - len(rows)
+        tail = numpy.ones(count - kept, dtype=numpy.bool_)
+        tail[rows[rows >= kept] - kept] = False
+        holes = rows[rows < kept]
+        moved = tail.nonzero()[0] + kept
+
+        for name in self.ROW_ARRAYS:
+            array = getattr(self, name)
+            array[holes] = array[moved]
+            array[kept:count] = 0
+
+        self.states.update(zip(self.keys[holes].tolist(), holes.tolist()))
+        self.evictions += len(rows)
+
+    def _grow(self):
+        """Double capacity of the table."""
+        for name in self.ROW_ARRAYS:
+            setattr(self, name, self._grown(getattr(self, name)))
+
+    @staticmethod
+    def _grown(array):
+        """Get copy of the array with doubled number of rows."""
+        grown = numpy.zeros((2 * len(array),) + array.shape[1:], dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+
+class Snapshot:
+    """Copy of the QLearning table data to be saved to the specified folder.
+    Doesn't share memory with the table, so it could be written from
+    a background thread, see athene.storage.writer.
+    """
+
+    def __init__(self, dst, arrays, meta, delta):
+        self.dst = dst
+        self.arrays = arrays
+        self.meta = meta
+        self.delta = delta
+
+    def write(self):
+        """Write the snapshot. The base checkpoint is replaced atomically."""
+        deltas = os.path.join(self.dst, CHECKPOINT_DELTA)
+
+        if self.delta:
+            checkpoint.append(deltas, self.arrays, **self.meta)
+            return
+
+        checkpoint.save(os.path.join(self.dst, CHECKPOINT), self.arrays, **self.meta)
+
+        if os.path.isfile(deltas):
+            os.remove(deltas)
+
+
+def _parse_state(label):
+    """Old dumps keep the states as strings, e.g. '(1, 12, 1, 0, 0)'.
+    Convert such labels back to tuples.
+    """
+    if not isinstance(label, str):
+        return label
+
+    try:
+        return ast.literal_eval(label)
+    except (ValueError, SyntaxError):
+        return label
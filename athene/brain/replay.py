@@ -0,0 +1,207 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Experience replay, the transitions seen during the games are kept and
+replayed to the QLearning table many times, so each expensive game step
+teaches the table more than once.
+"""
+
+import os
+
+import numpy
+
+from athene.storage.writer import atomic_write
+from .states import TERMINAL_KEY
+
+
+REPLAY = 'replay.npz'
+
+
+class ReplayBuffer:
+    """Fixed-capacity ring buffer of transitions, when it is full the oldest
+    transitions are overwritten. The transitions are kept in preallocated
+    arrays: state keys (see athene.brain.states), action ids, rewards,
+    next state keys, terminal flags and priorities.
+
+        Meaning of variables:
+        capacity - maximal number of the kept transitions.
+        alpha    - how much the priorities matter when sampling,
+                   0 means uniform sampling.
+        epsilon  - small priority added to each transition, so the ones
+                   with zero error still could be sampled.
+    """
+
+    def __init__(self, capacity=10000, alpha=0.6, epsilon=1e-3, seed=None):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.random = numpy.random.default_rng(seed)
+
+        self.states = numpy.zeros(capacity, dtype=numpy.int64)
+        self.actions = numpy.zeros(capacity, dtype=numpy.int32)
+        self.rewards = numpy.zeros(capacity, dtype=numpy.float64)
+        self.next_states = numpy.zeros(capacity, dtype=numpy.int64)
+        self.terminal = numpy.zeros(capacity, dtype=numpy.bool_)
+
+        # NOTE (alkurbatov): The priorities are kept raised to the power
+        # of alpha, so sampling doesn't have to do it.
+        self.priorities = numpy.zeros(capacity, dtype=numpy.float64)
+        self.max_priority = 1.0
+
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, s, a, r, s_):
+        """Add a transition given by the state keys and the action id,
+        TERMINAL_KEY marks end of the episode. New transitions get
+        the highest priority, so they are replayed at least once.
+        """
+        i = self.position
+
+        self.states[i] = s
+        self.actions[i] = a
+        self.rewards[i] = r
+        self.next_states[i] = s_
+        self.terminal[i] = s_ == TERMINAL_KEY
+        self.priorities[i] = self.max_priority
+
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def extend(self, s, a, r, s_):
+        """Add transitions given by the arrays of the state keys,
+        the action ids and the rewards, see add().
+        """
+        count = len(s)
+        if count > self.capacity:
+            s, a, r, s_ = s[-self.capacity:], a[-self.capacity:], \
+                r[-self.capacity:], s_[-self.capacity:]
+            count = self.capacity
+
+        slots = (self.position + numpy.arange(count)) % self.capacity
+
+        self.states[slots] = s
+        self.actions[slots] = a
+        self.rewards[slots] = r
+        self.next_states[slots] = s_
+        self.terminal[slots] = numpy.asarray(s_) == TERMINAL_KEY
+        self.priorities[slots] = self.max_priority
+
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def sample(self, batch_size, prioritized=False):
+        """Get indices of random transitions. With prioritization
+        the transitions are sampled proportionally to their priorities.
+        """
+        if not self.size:
+            return numpy.zeros(0, dtype=numpy.intp)
+
+        if not prioritized:
+            return self.random.integers(0, self.size, batch_size)
+
+        weights = numpy.cumsum(self.priorities[:self.size])
+        picks = self.random.random(batch_size) * weights[-1]
+        return numpy.minimum(
+            numpy.searchsorted(weights, picks, side='right'), self.size - 1)
+
+    def batch(self, indices):
+        """Get the transitions (s, a, r, s_) of the specified indices,
+        see QLearningTable.learn_batch().
+        """
+        return (
+            self.states[indices],
+            self.actions[indices],
+            self.rewards[indices],
+            self.next_states[indices],
+        )
+
+    def update_priorities(self, indices, errors):
+        """Set priorities of the transitions from their temporal
+        difference errors.
+        """
+        priorities = (numpy.abs(errors) + self.epsilon) ** self.alpha
+        self.priorities[indices] = priorities
+
+        if len(priorities):
+            self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def replay(self, qlearn, batch_size=64, batches=1, prioritized=False):
+        """Teach the QLearning table with random batches of transitions.
+        Returns the temporal difference errors of the last batch.
+        """
+        errors = numpy.zeros(0, dtype=numpy.float64)
+
+        for _ in range(batches):
+            indices = self.sample(batch_size, prioritized=prioritized)
+            if not len(indices):
+                break
+
+            errors = qlearn.learn_batch(*self.batch(indices), encoded=True)
+            self.update_priorities(indices, errors)
+
+        return errors
+
+    @staticmethod
+    def load(src, **kwargs):
+        """Initialize the buffer from the specified folder, the keyword
+        arguments are passed to the constructor. If there are more saved
+        transitions than the capacity, the latest ones are kept.
+        """
+        buffer = ReplayBuffer(**kwargs)
+
+        path = os.path.join(src, REPLAY)
+        if not os.path.isfile(path):
+            return buffer
+
+        with numpy.load(path) as saved:
+            buffer.extend(saved['states'], saved['actions'], saved['rewards'],
+                          saved['next_states'])
+
+            # NOTE (alkurbatov): extend() puts the transitions at the start
+            # of the empty buffer.
+            priorities = saved['priorities'][-buffer.capacity:]
+            buffer.priorities[:len(priorities)] = priorities
+            if len(priorities):
+                buffer.max_priority = max(1.0, float(priorities.max()))
+
+        return buffer
+
+    def dump(self, dst):
+        """Dump the buffer to the specified folder."""
+        self.snapshot(dst).write()
+
+    def snapshot(self, dst):
+        """Copy the transitions to be dumped to the specified folder, oldest
+        first. The snapshot could be written from another thread while
+        the buffer keeps filling, see athene.storage.writer.
+        """
+        order = numpy.arange(self.size)
+        if self.size == self.capacity:
+            order = (self.position + order) % self.capacity
+
+        return Snapshot(dst, {
+            'states': self.states[order],
+            'actions': self.actions[order],
+            'rewards': self.rewards[order],
+            'next_states': self.next_states[order],
+            'terminal': self.terminal[order],
+            'priorities': self.priorities[order],
+        })
+
+
+class Snapshot:
+    """Copy of the replay buffer data to be saved to the specified folder."""
+
+    def __init__(self, dst, arrays):
+        self.dst = dst
+        self.arrays = arrays
+
+    def write(self):
+        """Write the snapshot, the previous dump is replaced atomically."""
+        with atomic_write(os.path.join(self.dst, REPLAY)) as f:
+            numpy.savez(f, **self.arrays)
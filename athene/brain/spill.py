@@ -0,0 +1,116 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""On-disk store of the rows evicted from the memory-bounded QLearning table."""
+
+import os
+import tempfile
+import weakref
+
+import numpy
+
+
+class SpillStore:
+    """Memory-mapped file of fixed-size records, one record per evicted state.
+    The slots freed by the states paged back in are reused, the file doubles
+    its capacity when it is full. The file is scratch space: it is created
+    anew and removed together with the store, the evicted states are saved
+    in the table checkpoints as usual.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, actions_count, path=None):
+        self.dtype = numpy.dtype([
+            ('keys', numpy.int64),
+            ('q_values', numpy.float64, (actions_count,)),
+            ('disallowed_actions', numpy.bool_, (actions_count,)),
+            ('visits', numpy.uint32, (actions_count,)),
+            ('updated_at', numpy.uint32, (actions_count,)),
+            ('dirty', numpy.bool_),
+        ])
+
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='qlearn-', suffix='.spill')
+            os.close(fd)
+
+        self.path = path
+        self.slots = {}
+        self.free = []
+        self.records = None
+
+        self._resize(self.INITIAL_CAPACITY)
+        self._finalizer = weakref.finalize(self, _remove, path)
+
+    def __len__(self):
+        """Get number of the stored states."""
+        return len(self.slots)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def put(self, columns):
+        """Store the rows given as dict of arrays named after the fields
+        of the records.
+        """
+        keys = columns['keys'].tolist()
+
+        missing = len(keys) - len(self.free)
+        if missing > 0:
+            capacity = len(self.records)
+            self._resize(max(2 * capacity, capacity + missing))
+
+        slots = numpy.array([self.free.pop() for _ in keys], dtype=numpy.intp)
+        for name, values in columns.items():
+            self.records[name][slots] = values
+
+        self.slots.update(zip(keys, slots.tolist()))
+
+    def take(self, key):
+        """Remove the state from the store and return its record."""
+        slot = self.slots.pop(key)
+        self.free.append(slot)
+        return self.records[slot].copy()
+
+    def columns(self, dirty_only=False):
+        """Get copies of the stored rows as dict of arrays named after
+        the fields of the records. Optionally only the rows changed since
+        they were saved are returned, their dirty flags are cleared.
+        """
+        slots = numpy.fromiter(self.slots.values(), dtype=numpy.intp, count=len(self))
+        slots.sort()
+
+        if dirty_only:
+            slots = slots[self.records['dirty'][slots]]
+            self.records['dirty'][slots] = False
+
+        return {name: self.records[name][slots] for name in self.dtype.names}
+
+    def clear_dirty(self):
+        """Mark all the stored rows as saved."""
+        self.records['dirty'] = False
+
+    def close(self):
+        """Remove the file."""
+        self.records = None
+        self._finalizer()
+
+    def _resize(self, capacity):
+        """Grow the file to the specified number of records."""
+        size = 0 if self.records is None else len(self.records)
+        if self.records is not None:
+            self.records.flush()
+
+        with open(self.path, 'r+b' if size else 'wb') as f:
+            f.truncate(capacity * self.dtype.itemsize)
+
+        self.records = numpy.memmap(
+            self.path, dtype=self.dtype, mode='r+', shape=(capacity,))
+        self.free.extend(reversed(range(size, capacity)))
+
+
+def _remove(path):
+    """Remove the file if it exists."""
+    if os.path.isfile(path):
+        os.remove(path)
@@ -0,0 +1,105 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Encoders turning states of the QLearning table into integer keys."""
+
+import numpy
+
+
+TERMINAL = 'terminal'
+TERMINAL_KEY = -1
+
+
+class StateEncoder:
+    """Packs tuples of small non-negative integers into a single integer key.
+    Each feature declares its range, i.e. the number of possible values,
+    and the key is computed as a mixed-radix number. Values out of the range
+    are clamped to its edges.
+    """
+
+    def __init__(self, ranges, names=None):
+        self.ranges = tuple(int(limit) for limit in ranges)
+        if not self.ranges or min(self.ranges) < 1:
+            raise ValueError('Each feature must have a positive range')
+
+        if names is not None and len(names) != len(self.ranges):
+            raise ValueError('Number of names must match number of ranges')
+
+        self.names = tuple(names) if names is not None else None
+        self.size = int(numpy.prod(self.ranges, dtype=numpy.float64))
+        if self.size > numpy.iinfo(numpy.int64).max:
+            raise ValueError('The state space does not fit into 64-bit keys')
+
+    def __eq__(self, other):
+        return isinstance(other, StateEncoder) and self.ranges == other.ranges
+
+    def __hash__(self):
+        return hash(self.ranges)
+
+    def encode(self, state):
+        """Get the integer key of the state."""
+        if len(state) != len(self.ranges):
+            raise ValueError(
+                'Expected {} features, got {}'.format(len(self.ranges), len(state)))
+
+        key = 0
+        for value, limit in zip(state, self.ranges):
+            value = int(value)
+            if value < 0:
+                value = 0
+            elif value >= limit:
+                value = limit - 1
+
+            key = key * limit + value
+
+        return key
+
+    def decode(self, key):
+        """Get the state tuple packed into the key."""
+        key = int(key)
+        values = []
+        for limit in reversed(self.ranges):
+            key, value = divmod(key, limit)
+            values.append(value)
+
+        return tuple(reversed(values))
+
+    def decode_many(self, keys):
+        """Decode an array of keys into a 2D array, one state per row."""
+        keys = numpy.asarray(keys, dtype=numpy.int64)
+        states = numpy.empty((len(keys), len(self.ranges)), dtype=numpy.int64)
+        for i in reversed(range(len(self.ranges))):
+            keys, states[:, i] = numpy.divmod(keys, self.ranges[i])
+
+        return states
+
+
+class StateIndex:
+    """Perfect hash for arbitrary hashable states: each new state gets
+    the next free integer key. Used by default when the state space is not
+    declared, the keys are valid only together with the index.
+    """
+
+    def __init__(self):
+        self.names = None
+        self.keys = {}
+        self.states = []
+
+    def encode(self, state):
+        """Get the integer key of the state, register it if needed."""
+        key = self.keys.get(state)
+        if key is None:
+            key = len(self.states)
+            self.keys[state] = key
+            self.states.append(state)
+
+        return key
+
+    def decode(self, key):
+        """Get the state registered under the key."""
+        return self.states[key]
+
+    def decode_many(self, keys):
+        """Decode an array of keys into a list of states."""
+        return [self.states[key] for key in keys]
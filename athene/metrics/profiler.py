@@ -0,0 +1,141 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Lightweight timing of the agents hot paths.
+
+To enable profiling set the ATHENE_PROFILE environment variable, e.g.
+$ ATHENE_PROFILE=1 python -m pysc2.bin.agent --map CollectMineralsAndGas --agent athene.minigames.collect_minerals_and_gas.Agent
+"""
+
+import contextlib
+import functools
+import os
+import time
+
+
+# NOTE (alkurbatov): Latencies are collected into buckets by powers of two
+# of nanoseconds, the last bucket holds everything longer than ~9 minutes.
+BUCKETS = 40
+
+PROFILE_COLUMNS = (
+    ('episode', 'i8'),
+    ('phase', 'U32'),
+    ('calls', 'i8'),
+    ('total_ms', 'f8'),
+    ('mean_us', 'f8'),
+    ('p50_us', 'f8'),
+    ('p99_us', 'f8'),
+)
+
+_DISABLED = contextlib.nullcontext()
+
+
+class Phase:
+    """Call count, total time and latency histogram of a named phase.
+    Used as a context manager, must not be nested into itself.
+    """
+
+    __slots__ = ('name', 'calls', 'total', 'histogram', 'started_at')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0
+        self.histogram = [0] * BUCKETS
+        self.started_at = 0
+
+    def __enter__(self):
+        self.started_at = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.started_at
+        self.calls += 1
+        self.total += elapsed
+        self.histogram[min(elapsed.bit_length(), BUCKETS - 1)] += 1
+        return False
+
+    def percentile(self, q):
+        """Get upper bound of the specified latency percentile in nanoseconds."""
+        threshold = q * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= threshold:
+                return 1 << bucket
+
+        return 0
+
+    def summary(self):
+        """Get the phase statistics as a dict."""
+        return {
+            'phase': self.name,
+            'calls': self.calls,
+            'total_ms': self.total / 1e6,
+            'mean_us': self.total / self.calls / 1e3 if self.calls else 0.0,
+            'p50_us': self.percentile(0.5) / 1e3,
+            'p99_us': self.percentile(0.99) / 1e3,
+        }
+
+
+class Profiler:
+    """Collects timings of the named phases, e.g.
+
+        with profiler.phase('choose_action'):
+            action = qlearn.choose_action(state)
+
+    When disabled, phase() returns a shared no-op context manager and
+    timed() returns the function as is, so the overhead is near zero.
+    """
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = bool(os.environ.get('ATHENE_PROFILE'))
+
+        self.enabled = enabled
+        self.phases = {}
+
+    def phase(self, name):
+        """Get context manager measuring the named phase."""
+        if not self.enabled:
+            return _DISABLED
+
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase(name)
+
+        return phase
+
+    def timed(self, name):
+        """Decorator measuring calls of the function as the named phase."""
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def summary(self):
+        """Get statistics of all the phases, the slowest first."""
+        phases = sorted(self.phases.values(), key=lambda phase: -phase.total)
+        return [phase.summary() for phase in phases]
+
+    def reset(self):
+        """Forget the collected statistics, e.g. at the end of an episode."""
+        self.phases = {}
+
+    def export(self, metrics, episode):
+        """Record summary of the episode to the metrics store created with
+        PROFILE_COLUMNS (see athene.metrics.store) and reset the statistics.
+        """
+        for summary in self.summary():
+            metrics.record(episode=episode, **summary)
+
+        self.reset()
@@ -2,19 +2,193 @@
 #
 # Copyright (c) 2017-2018 Alexander Kurbatov
 
+"""Buffered storage of the metrics collected across episodes."""
+
+import atexit
+import json
 import os
+import struct
+import time
+
+import numpy
+
+
+MAGIC = b'ATHM'
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct('<4sI')
+
+EPISODE_COLUMNS = (
+    ('episode', 'i8'),
+    ('score', 'f8'),
+    ('steps', 'i8'),
+    ('wall_time', 'f8'),
+    ('steps_per_sec', 'f8'),
+    ('qtable_size', 'i8'),
+    ('explorations', 'i8'),
+)
+
+
+class Store:
+    """Append-only table of records with a fixed set of named columns.
+    The records are kept in memory and flushed to the file in batches,
+    when the buffer is full or the flush interval has passed.
+
+    The format is chosen by extension of the file:
+    .csv - plain text with a single header line.
+    .bin - a header describing the columns followed by the raw records of
+           the corresponding numpy structured type, see read().
+    """
+
+    def __init__(self, dst, columns, flush_size=100, flush_interval=60.0):
+        self.dst = dst
+        self.dtype = numpy.dtype([(name, dtype) for name, dtype in columns])
+        self.binary = dst.endswith('.bin')
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self.records = []
+        self.flushed_at = time.monotonic()
+        self.count = self._open()
+
+        atexit.register(self.flush)
+
+    def __len__(self):
+        """Get number of the stored records including the buffered ones."""
+        return self.count + len(self.records)
+
+    @property
+    def columns(self):
+        """Get names of the columns."""
+        return self.dtype.names
+
+    def record(self, *values, **columns):
+        """Add record to the buffer, values are in the order of columns.
+        Omitted columns are filled with zeros.
+        """
+        row = dict(zip(self.columns, values))
+        row.update(columns)
+        self.records.append(tuple(row.get(name, 0) for name in self.columns))
+
+        if len(self.records) >= self.flush_size or \
+           time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to the file."""
+        self.flushed_at = time.monotonic()
+        if not self.records:
+            return
+
+        records, self.records = self.records, []
+        self.count += len(records)
+        records = numpy.array(records, dtype=self.dtype)
+
+        if self.binary:
+            with open(self.dst, 'ab') as f:
+                records.tofile(f)
+        else:
+            with open(self.dst, 'a') as f:
+                for row in records.tolist():
+                    f.write(','.join(str(value) for value in row) + '\n')
+
+    def _open(self):
+        """Write the header into a new file or check the header of
+        the existing one. Returns number of the stored records.
+        """
+        if not os.path.isfile(self.dst) or os.path.getsize(self.dst) == 0:
+            if self.binary:
+                with open(self.dst, 'wb') as f:
+                    _write_header(f, self.dtype)
+            else:
+                with open(self.dst, 'w') as f:
+                    f.write(','.join(self.columns) + '\n')
+
+            return 0
+
+        if self.binary:
+            dtype, offset = _read_header(self.dst)
+            if dtype != self.dtype:
+                raise ValueError('{} has different columns'.format(self.dst))
+
+            return (os.path.getsize(self.dst) - offset) // dtype.itemsize
+
+        with open(self.dst) as f:
+            if f.readline().rstrip('\n').split(',') != list(self.columns):
+                raise ValueError('{} has different columns'.format(self.dst))
+
+            return sum(1 for _ in f)
+
+
+class Episodes(Store):
+    """Per-episode telemetry of an agent, see EPISODE_COLUMNS."""
+
+    def __init__(self, dst, **kwargs):
+        super().__init__(dst, EPISODE_COLUMNS, **kwargs)
+
+        self.steps = 0
+        self.started_at = time.monotonic()
+
+    def start(self):
+        """Mark start of a new episode."""
+        self.steps = 0
+        self.started_at = time.monotonic()
+
+    def step(self):
+        """Count a step of the current episode."""
+        self.steps += 1
+
+    def finish(self, score, qtable_size=0, explorations=0):
+        """Record results of the current episode."""
+        wall_time = time.monotonic() - self.started_at
+
+        self.record(
+            episode=len(self),
+            score=score,
+            steps=self.steps,
+            wall_time=wall_time,
+            steps_per_sec=self.steps / wall_time if wall_time > 0 else 0.0,
+            qtable_size=qtable_size,
+            explorations=explorations,
+        )
+
+
+def read(src):
+    """Read the stored records as numpy structured array.
+    The binary files are memory-mapped.
+    """
+    if not src.endswith('.bin'):
+        return numpy.genfromtxt(src, delimiter=',', names=True, dtype=None, ndmin=1)
+
+    dtype, offset = _read_header(src)
+    count = (os.path.getsize(src) - offset) // dtype.itemsize
+    if not count:
+        return numpy.zeros(0, dtype=dtype)
+
+    return numpy.memmap(src, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
+def _write_header(f, dtype):
+    """Write description of the columns into the binary file."""
+    blob = json.dumps({'columns': dtype.descr}).encode('utf-8')
+    size = _PREFIX.size + len(blob)
+    padding = (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT - size
 
+    f.write(_PREFIX.pack(MAGIC, len(blob) + padding))
+    f.write(blob)
+    f.write(b' ' * padding)
 
-class Score:
-    """Store the score across episodes in .CSV format."""
 
-    def __init__(self, dst):
-        self.dst = os.path.join(dst, 'score.csv')
+def _read_header(src):
+    """Read description of the columns from the binary file.
+    Returns the records type and offset of the first record.
+    """
+    with open(src, 'rb') as f:
+        magic, length = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a metrics file'.format(src))
 
-        with open(self.dst, 'a') as f:
-            f.write('score\n')
+        description = json.loads(f.read(length).decode('utf-8'))
 
-    def record(self, score):
-        """Add record to the file."""
-        with open(self.dst, 'a') as f:
-            f.write(str(score) + '\n')
+    columns = [(name, dtype) for name, dtype in description['columns']]
+    return numpy.dtype(columns), _PREFIX.size + length
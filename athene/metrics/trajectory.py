@@ -0,0 +1,177 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Recording of the decisions made by an agent during the episodes.
+Each episode is saved as one or more compressed chunks, e.g.
+episode-000003-001.npz is the second chunk of the fourth episode.
+
+To enable recording set the ATHENE_TRAJECTORIES environment variable, e.g.
+$ ATHENE_TRAJECTORIES=1 python -m pysc2.bin.agent --map CollectMineralsAndGas --agent athene.minigames.collect_minerals_and_gas.Agent
+"""
+
+import os
+import re
+import time
+
+import numpy
+
+from athene.storage.writer import atomic_write
+
+
+TRAJECTORIES = 'trajectories'
+
+_CHUNK = re.compile(r'^episode-(\d+)-(\d+)\.npz$')
+
+
+class Recorder:
+    """Buffers the decisions of the current episode in preallocated arrays:
+    state keys (see athene.brain.states), masks of the excluded actions,
+    ids of the chosen actions, rewards, steps and timestamps. The full buffer
+    and the rest of the episode are written as compressed chunks.
+
+        Meaning of variables:
+        dst        - folder to save the chunks to.
+        actions    - number of the actions of the agent.
+        chunk_size - maximal number of decisions in a chunk.
+        writer     - optional athene.storage.writer.BackgroundWriter
+                     writing the chunks, they are written in place otherwise.
+    """
+
+    def __init__(self, dst, actions, chunk_size=4096, writer=None, enabled=None):
+        if enabled is None:
+            enabled = bool(os.environ.get('ATHENE_TRAJECTORIES'))
+
+        self.enabled = enabled
+        self.dst = dst
+        self.chunk_size = chunk_size
+        self.writer = writer
+
+        self.states = numpy.zeros(chunk_size, dtype=numpy.int64)
+        self.masks = numpy.zeros((chunk_size, actions), dtype=numpy.bool_)
+        self.actions = numpy.zeros(chunk_size, dtype=numpy.int16)
+        self.rewards = numpy.zeros(chunk_size, dtype=numpy.float64)
+        self.steps = numpy.zeros(chunk_size, dtype=numpy.int32)
+        self.timestamps = numpy.zeros(chunk_size, dtype=numpy.float64)
+        self.size = 0
+
+        self.episode = 0
+        self.chunk = 0
+        if self.enabled:
+            os.makedirs(dst, exist_ok=True)
+            self.episode = 1 + max(
+                (int(match.group(1)) for match in map(_CHUNK.match, os.listdir(dst))
+                 if match),
+                default=-1
+            )
+
+    def __len__(self):
+        """Get number of the buffered decisions."""
+        return self.size
+
+    def record(self, state, mask, action, reward, step):
+        """Add a decision: the state key, the mask of the excluded actions
+        (None if nothing is excluded), id of the chosen action and the reward
+        learned with the transition into this state. The last step is recorded
+        with athene.brain.states.TERMINAL_KEY as the state and -1 as the action.
+        """
+        if not self.enabled:
+            return
+
+        i = self.size
+        self.states[i] = state
+        self.masks[i] = False if mask is None else mask
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.steps[i] = step
+        self.timestamps[i] = time.time()
+        self.size += 1
+
+        if self.size == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered decisions as the next chunk of the episode."""
+        if not self.enabled or not self.size:
+            return
+
+        chunk = Chunk(
+            os.path.join(self.dst, 'episode-{:06d}-{:03d}.npz'.format(
+                self.episode, self.chunk)),
+            {
+                'states': self.states[:self.size].copy(),
+                'masks': numpy.packbits(self.masks[:self.size], axis=1),
+                'actions': self.actions[:self.size].copy(),
+                'rewards': self.rewards[:self.size].copy(),
+                'steps': self.steps[:self.size].copy(),
+                'timestamps': self.timestamps[:self.size].copy(),
+            }
+        )
+
+        self.size = 0
+        self.chunk += 1
+
+        if self.writer is not None:
+            self.writer.submit(chunk.write)
+        else:
+            chunk.write()
+
+    def finish(self):
+        """Write the rest of the current episode and start the next one."""
+        if not self.enabled:
+            return
+
+        self.flush()
+        self.episode += 1
+        self.chunk = 0
+
+
+class Chunk:
+    """Copy of the recorded decisions to be saved to the specified file."""
+
+    def __init__(self, path, arrays):
+        self.path = path
+        self.arrays = arrays
+
+    def write(self):
+        """Write the chunk, so a half-written file is never seen."""
+        with atomic_write(self.path) as f:
+            numpy.savez_compressed(f, **self.arrays)
+
+
+def read(src, actions):
+    """Iterate over the episodes saved in the specified folder, oldest
+    first. Yields (episode, arrays) where the arrays are named as
+    the Recorder buffers, the masks are unpacked for the specified number
+    of actions. Only one episode is kept in memory at a time.
+    """
+    chunks = {}
+    for name in os.listdir(src):
+        match = _CHUNK.match(name)
+        if match:
+            chunks.setdefault(int(match.group(1)), []).append((int(match.group(2)), name))
+
+    for episode in sorted(chunks):
+        parts = []
+        for _, name in sorted(chunks[episode]):
+            with numpy.load(os.path.join(src, name)) as saved:
+                parts.append({key: saved[key] for key in saved.files})
+
+        arrays = {
+            key: numpy.concatenate([part[key] for part in parts]) for key in parts[0]
+        }
+        arrays['masks'] = numpy.unpackbits(
+            arrays['masks'], axis=1, count=actions).astype(numpy.bool_)
+
+        yield episode, arrays
+
+
+def transitions(arrays):
+    """Turn the decisions of an episode into transitions (s, a, r, s_)
+    of state keys, see QLearningTable.learn_batch(encoded=True) and
+    athene.brain.replay.ReplayBuffer.extend(). The reward of a transition
+    is the one recorded with the next decision, i.e. the reward the agent
+    learned it with. The last transition ends with TERMINAL_KEY.
+    """
+    states = arrays['states']
+    return states[:-1], arrays['actions'][:-1], arrays['rewards'][1:], states[1:]
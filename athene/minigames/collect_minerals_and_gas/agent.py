@@ -22,10 +22,16 @@ from athene.api.actions import \
     ACTION_DO_NOTHING, \
     ACTION_HARVEST_MINERALS, \
     ACTION_TRAIN_SCV
-from athene.api.actions import Stages, cannot, cannot_afford
-from athene.api.screen import UnitPos, UnitPosList, UnitPosClustersList
+from athene.api.actions import cannot_afford_many, cost_matrix, resources
+from athene.api.plans import ActionPlan, Planner
+from athene.api.screen import ScreenTracker, UnitPos, UnitPosBlobsList
 from athene.brain.qlearning import QLearningTable
+from athene.brain.replay import ReplayBuffer
+from athene.brain.states import TERMINAL, TERMINAL_KEY, StateEncoder
 from athene.metrics import store
+from athene.metrics.profiler import PROFILE_COLUMNS, Profiler
+from athene.metrics.trajectory import TRAJECTORIES, Recorder
+from athene.storage.writer import BackgroundWriter
 
 
 class Agent(base_agent.BaseAgent):
@@ -41,15 +47,74 @@ class Agent(base_agent.BaseAgent):
         ACTION_BUILD_REFINERY,
     ]
 
-    def __init__(self):
+    # NOTE (alkurbatov): Costs of the smart actions, see step().
+    ACTION_COSTS = cost_matrix(SMART_ACTIONS)
+
+    # NOTE (alkurbatov): Units tracked on the screen on each step.
+    UNIT_TYPES = (
+        units.Terran.CommandCenter,
+        units.Terran.Refinery,
+        units.Terran.SCV,
+        units.Terran.SupplyDepot,
+    )
+
+    # NOTE (alkurbatov): Number of possible values of each feature
+    # of the current state, see step().
+    STATE = StateEncoder(
+        ranges=(256, 256, 8, 8, 8),
+        names=('idle_workers', 'food_workers', 'town_halls', 'supplies', 'refineries'),
+    )
+
+    # NOTE (alkurbatov): Number and size of the batches of the remembered
+    # transitions replayed at the end of each episode.
+    REPLAY_BATCHES = 16
+    REPLAY_BATCH_SIZE = 64
+
+    def __init__(self, data_folder=None, qlearn=None):
         super().__init__()
 
-        self.qlearn = QLearningTable.load(
-            actions=self.SMART_ACTIONS,
-            src=self.DATA_FOLDER,
-        )
+        self.data_folder = data_folder or self.DATA_FOLDER
+        os.makedirs(self.data_folder, exist_ok=True)
+
+        self.qlearn = qlearn
+        if self.qlearn is None:
+            self.qlearn = QLearningTable.load(
+                actions=self.SMART_ACTIONS,
+                src=self.data_folder,
+                encoder=self.STATE,
+            )
 
-        self.stage = None
+        self.replay = ReplayBuffer.load(self.data_folder)
+        self.tracker = ScreenTracker(self.UNIT_TYPES)
+
+        self.planner = Planner({
+            ACTION_DO_NOTHING: ActionPlan(),
+            ACTION_BUILD_COMMAND_CENTER: ActionPlan(
+                select=self.select_scv,
+                issue=self.build_command_center,
+                issue_requires=actions.FUNCTIONS.Build_CommandCenter_screen.id,
+            ),
+            ACTION_HARVEST_MINERALS: ActionPlan(
+                select=self.select_idle_worker,
+                issue=self.harvest_minerals,
+                select_requires=actions.FUNCTIONS.select_idle_worker.id,
+            ),
+            ACTION_TRAIN_SCV: ActionPlan(
+                select=self.select_town_hall,
+                issue=self.train_scv,
+                issue_requires=actions.FUNCTIONS.Train_SCV_quick.id,
+            ),
+            ACTION_BUILD_SUPPLY: ActionPlan(
+                select=self.select_scv,
+                issue=self.build_supply,
+                issue_requires=actions.FUNCTIONS.Build_SupplyDepot_screen.id,
+            ),
+            ACTION_BUILD_REFINERY: ActionPlan(
+                select=self.select_scv,
+                issue=self.build_refinery,
+                issue_requires=actions.FUNCTIONS.Build_Refinery_screen.id,
+            ),
+        })
 
         self.minerals = None
         self.geysers = None
@@ -58,80 +123,140 @@ class Agent(base_agent.BaseAgent):
         self.executed_action = None
         self.previous_state = None
 
-        self.metrics = store.Score(self.DATA_FOLDER)
+        self.explorations = 0
+        self.metrics = store.Episodes(os.path.join(self.data_folder, 'episodes.csv'))
+        self.writer = BackgroundWriter()
+
+        self.profiler = Profiler()
+        self.profile = None
+        if self.profiler.enabled:
+            self.profile = store.Store(
+                os.path.join(self.data_folder, 'profile.csv'), PROFILE_COLUMNS)
+
+        self.trajectory = Recorder(
+            os.path.join(self.data_folder, TRAJECTORIES),
+            len(self.SMART_ACTIONS),
+            writer=self.writer,
+        )
+
+    def save(self):
+        """Save the QLearning table at the end of an episode."""
+        # NOTE (alkurbatov): Save the results in background to not
+        # delay the next episode.
+        snapshot = self.qlearn.snapshot(self.data_folder, delta=True)
+        self.writer.submit(snapshot.write)
+        self.writer.submit(self.replay.snapshot(self.data_folder).write)
+
+    def remember(self, s, a, r, s_):
+        """Keep the transition for the experience replay."""
+        s_ = TERMINAL_KEY if s_ == TERMINAL else self.qlearn.encode(s_)
+        self.replay.add(self.qlearn.encode(s), self.qlearn.action_ids[a], r, s_)
+
+    def replay_experience(self):
+        """Teach the QLearning table with the remembered transitions."""
+        self.replay.replay(
+            self.qlearn,
+            batch_size=self.REPLAY_BATCH_SIZE,
+            batches=self.REPLAY_BATCHES,
+            prioritized=True,
+        )
 
     def step(self, obs):
         super().step(obs)
+        self.metrics.step()
 
-        unit_type = obs.observation.feature_screen.unit_type
+        with self.profiler.phase('step'):
+            call = self._step(obs)
 
-        if obs.first():
-            self.stage = Stages.CHOOSE_ACTION
-            cc_y, cc_x = (unit_type == units.Terran.CommandCenter).nonzero()
-            self.town_hall = UnitPos(cc_x, cc_y)
+        # NOTE (alkurbatov): Export the statistics after the last step
+        # is measured, so the export itself is not counted.
+        if obs.last() and self.profile is not None:
+            self.profiler.export(self.profile, episode=len(self.metrics) - 1)
 
-            # NOTE (alkurbatov): Cache positions of mineral patches and geysers.
-            self.minerals = UnitPosClustersList.locate(
-                obs,
-                units.Neutral.MineralField)
-            self.geysers = UnitPosClustersList.locate(
-                obs,
-                units.Neutral.VespeneGeyser)
+        return call
 
-        if obs.last():
-            self.qlearn.learn(
-                self.previous_state,
-                self.executed_action,
-                obs.reward,
-                'terminal'
-            )
+    def _step(self, obs):
+        with self.profiler.phase('locate'):
+            screen = self.tracker.update(obs)
 
-            self.qlearn.dump(self.DATA_FOLDER)
-            self.metrics.record(obs.observation.score_cumulative.score)
-            return actions.FUNCTIONS.no_op()
-
-        supplies = UnitPosList.locate(obs, units.Terran.SupplyDepot)
+        if obs.first():
+            # NOTE (alkurbatov): Don't learn the transition from the last
+            # state of the previous episode.
+            self.previous_state = None
+            self.executed_action = None
 
-        if self.stage == Stages.CHOOSE_ACTION:
-            self.stage = Stages.SELECT_UNIT
+            self.planner.reset()
+            self.metrics.start()
+            self.explorations = self.qlearn.explorations
 
-            town_halls = UnitPosList.locate(obs, units.Terran.CommandCenter)
-            refineries = UnitPosList.locate(obs, units.Terran.Refinery)
+            town_halls = screen[units.Terran.CommandCenter]
+            self.town_hall = UnitPos(town_halls.pos_x, town_halls.pos_y)
 
-            current_state = (
-                obs.observation.player.idle_worker_count,
-                obs.observation.player.food_workers,
-                len(town_halls),
-                len(supplies),
-                len(refineries)
-            )
+            # NOTE (alkurbatov): Cache positions of mineral patches and geysers.
+            with self.profiler.phase('cluster'):
+                self.minerals = UnitPosBlobsList.locate(
+                    obs,
+                    units.Neutral.MineralField)
+                self.geysers = UnitPosBlobsList.locate(
+                    obs,
+                    units.Neutral.VespeneGeyser)
 
-            if self.executed_action:
+        if obs.last():
+            with self.profiler.phase('learn'):
                 self.qlearn.learn(
                     self.previous_state,
                     self.executed_action,
-                    0,
-                    current_state
+                    obs.reward,
+                    TERMINAL
                 )
 
-            excluded_actions = set()
+            self.remember(self.previous_state, self.executed_action, obs.reward, TERMINAL)
+            self.trajectory.record(TERMINAL_KEY, None, -1, obs.reward, self.metrics.steps)
+
+            with self.profiler.phase('replay'):
+                self.replay_experience()
+
+            with self.profiler.phase('dump'):
+                self.save()
+                self.trajectory.finish()
+
+            self.metrics.finish(
+                obs.observation.score_cumulative.score,
+                qtable_size=len(self.qlearn),
+                explorations=self.qlearn.explorations - self.explorations,
+            )
+            return actions.FUNCTIONS.no_op()
 
-            if obs.observation.player.idle_worker_count == 0:
-                excluded_actions.add(ACTION_HARVEST_MINERALS)
+        call = self.planner.step(obs, screen)
+        if call is not None:
+            return call
 
-            if cannot_afford(obs, ACTION_TRAIN_SCV):
-                excluded_actions.add(ACTION_TRAIN_SCV)
+        town_halls = screen[units.Terran.CommandCenter]
+        supplies = screen[units.Terran.SupplyDepot]
+        refineries = screen[units.Terran.Refinery]
 
-            if len(supplies) >= 2 or cannot_afford(obs, ACTION_BUILD_SUPPLY):
-                excluded_actions.add(ACTION_BUILD_SUPPLY)
+        current_state = (
+            obs.observation.player.idle_worker_count,
+            obs.observation.player.food_workers,
+            len(town_halls),
+            len(supplies),
+            len(refineries)
+        )
 
-            if not self.geysers or cannot_afford(obs, ACTION_BUILD_REFINERY):
-                excluded_actions.add(ACTION_BUILD_REFINERY)
+        # NOTE (alkurbatov): The mask is aligned with SMART_ACTIONS.
+        excluded_actions = cannot_afford_many(self.ACTION_COSTS, resources(obs))
 
-            if len(town_halls) >= 2 or cannot_afford(obs, ACTION_BUILD_COMMAND_CENTER):
-                excluded_actions.add(ACTION_BUILD_COMMAND_CENTER)
+        limits = (
+            (ACTION_HARVEST_MINERALS, obs.observation.player.idle_worker_count == 0),
+            (ACTION_BUILD_SUPPLY, len(supplies) >= 2),
+            (ACTION_BUILD_REFINERY, not self.geysers),
+            (ACTION_BUILD_COMMAND_CENTER, len(town_halls) >= 2),
+        )
+        for action, limited in limits:
+            excluded_actions[self.qlearn.action_ids[action]] |= limited
 
-            if self.executed_action:
+        if self.executed_action:
+            with self.profiler.phase('learn'):
                 self.qlearn.learn(
                     self.previous_state,
                     self.executed_action,
@@ -139,75 +264,68 @@ class Agent(base_agent.BaseAgent):
                     current_state
                 )
 
+            self.remember(self.previous_state, self.executed_action, 0, current_state)
+
+        with self.profiler.phase('choose_action'):
             smart_action = self.qlearn.choose_action(
                 current_state,
                 excluded_actions=excluded_actions
             )
 
-            self.previous_state = current_state
-            self.executed_action = smart_action
-
-            return actions.FUNCTIONS.no_op()
-
-        if self.executed_action == ACTION_DO_NOTHING:
-            self.stage = Stages.CHOOSE_ACTION
-            return actions.FUNCTIONS.no_op()
-
-        if self.stage == Stages.SELECT_UNIT:
-            self.stage = Stages.ISSUE_ORDER
-
-            if self.executed_action == ACTION_TRAIN_SCV:
-                cc_y, cc_x = (unit_type == units.Terran.CommandCenter).nonzero()
-
-                cc = UnitPosList.locate(obs, units.Terran.CommandCenter).random_point()
-                return actions.FUNCTIONS.select_point('select', cc.pos)
-
-            if self.executed_action == ACTION_HARVEST_MINERALS:
-                if cannot(obs, actions.FUNCTIONS.select_idle_worker.id):
-                    return actions.FUNCTIONS.no_op()
-
-                return actions.FUNCTIONS.select_idle_worker('select_all')
-
-            # NOTE (alkurbatov): All other actions require an SCV.
-            scv = UnitPosList.locate(obs, units.Terran.SCV).random_point()
-            return actions.FUNCTIONS.select_point('select', scv.pos)
-
-        if self.stage == Stages.ISSUE_ORDER:
-            self.stage = Stages.CHOOSE_ACTION
-
-            if self.executed_action == ACTION_TRAIN_SCV:
-                if cannot(obs, actions.FUNCTIONS.Train_SCV_quick.id):
-                    return actions.FUNCTIONS.no_op()
-
-                return actions.FUNCTIONS.Train_SCV_quick('now')
-
-            if self.executed_action == ACTION_HARVEST_MINERALS:
-                mineral_patch = self.minerals.random_unit()
-                return actions.FUNCTIONS.Harvest_Gather_screen('now', mineral_patch.pos)
-
-            if self.executed_action == ACTION_BUILD_REFINERY:
-                if cannot(obs, actions.FUNCTIONS.Build_Refinery_screen.id):
-                    return actions.FUNCTIONS.no_op()
-
-                geyser = self.geysers.pop_random_unit()
-                return actions.FUNCTIONS.Build_Refinery_screen('now', geyser.pos)
-
-            if self.executed_action == ACTION_BUILD_SUPPLY:
-                if cannot(obs, actions.FUNCTIONS.Build_SupplyDepot_screen.id):
-                    return actions.FUNCTIONS.no_op()
-
-                if supplies:
-                    return actions.FUNCTIONS.Build_SupplyDepot_screen(
-                        'now', self.town_hall.shift(0, -20).pos)
-
-                return actions.FUNCTIONS.Build_SupplyDepot_screen(
-                    'now', self.town_hall.shift(0, 20).pos)
-
-            if self.executed_action == ACTION_BUILD_COMMAND_CENTER:
-                if cannot(obs, actions.FUNCTIONS.Build_CommandCenter_screen.id):
-                    return actions.FUNCTIONS.no_op()
+        # NOTE (alkurbatov): Record the reward learned above, the score
+        # is rewarded only at the end of the episode.
+        self.trajectory.record(
+            self.qlearn.encode(current_state),
+            excluded_actions,
+            self.qlearn.action_ids[smart_action],
+            0,
+            self.metrics.steps,
+        )
 
-                return actions.FUNCTIONS.Build_CommandCenter_screen(
-                    'now', self.town_hall.shift(16, 0).pos)
+        self.previous_state = current_state
+        self.executed_action = smart_action
+        self.planner.start(smart_action)
 
         return actions.FUNCTIONS.no_op()
+
+    def select_town_hall(self, _obs, screen):
+        """Select a command center."""
+        cc = screen[units.Terran.CommandCenter].random_point()
+        return actions.FUNCTIONS.select_point('select', cc.pos)
+
+    def select_idle_worker(self, _obs, _screen):
+        """Select all the idle SCVs."""
+        return actions.FUNCTIONS.select_idle_worker('select_all')
+
+    def select_scv(self, _obs, screen):
+        """Select a random SCV."""
+        scv = screen[units.Terran.SCV].random_point()
+        return actions.FUNCTIONS.select_point('select', scv.pos)
+
+    def train_scv(self, _obs, _screen):
+        """Order the selected command center to train an SCV."""
+        return actions.FUNCTIONS.Train_SCV_quick('now')
+
+    def harvest_minerals(self, _obs, _screen):
+        """Send the selected SCVs to a random mineral patch."""
+        mineral_patch = self.minerals.random_unit()
+        return actions.FUNCTIONS.Harvest_Gather_screen('now', mineral_patch.pos)
+
+    def build_refinery(self, _obs, _screen):
+        """Build refinery on a free vespene geyser."""
+        geyser = self.geysers.pop_random_unit()
+        return actions.FUNCTIONS.Build_Refinery_screen('now', geyser.pos)
+
+    def build_supply(self, _obs, screen):
+        """Build supply depot next to the command center."""
+        if screen[units.Terran.SupplyDepot]:
+            return actions.FUNCTIONS.Build_SupplyDepot_screen(
+                'now', self.town_hall.shift(0, -20).pos)
+
+        return actions.FUNCTIONS.Build_SupplyDepot_screen(
+            'now', self.town_hall.shift(0, 20).pos)
+
+    def build_command_center(self, _obs, _screen):
+        """Build one more command center next to the first one."""
+        return actions.FUNCTIONS.Build_CommandCenter_screen(
+            'now', self.town_hall.shift(16, 0).pos)
@@ -19,10 +19,11 @@ from pysc2.lib import features
 from pysc2.lib import units
 
 from athene.api.actions import \
-    ACTION_DO_NOTHING, \
     ACTION_MOVE_TO_BEACON, \
     ACTION_SELECT_MARINE
-from athene.api.geometry import DIAMETERS
+from athene.api.actions import cannot
+from athene.api.geometry import footprint, resolution
+from athene.api.plans import ActionPlan, Planner
 from athene.api.screen import UnitPos
 
 
@@ -31,57 +32,69 @@ class Agent(base_agent.BaseAgent):
     def __init__(self):
         super().__init__()
 
-        self.smart_action = ACTION_DO_NOTHING
+        self.planner = Planner({
+            ACTION_SELECT_MARINE: ActionPlan(select=self.select_marine),
+            ACTION_MOVE_TO_BEACON: ActionPlan(
+                issue=self.move_to_beacon,
+                issue_requires=actions.FUNCTIONS.Move_screen.id,
+            ),
+        })
 
     def step(self, obs):
         super().step(obs)
 
         if obs.first():
             print('[INFO] Game started!')
-            self.smart_action = ACTION_SELECT_MARINE
+            self.planner.start(ACTION_SELECT_MARINE)
             return actions.FUNCTIONS.no_op()
 
         if obs.last():
             print('[INFO] Game Finished!')
             return actions.FUNCTIONS.no_op()
 
-        if self.smart_action == ACTION_SELECT_MARINE:
-            unit_type = obs.observation.feature_screen.unit_type
-            marine_y, marine_x = (unit_type == units.Terran.Marine).nonzero()
+        if self.planner.idle:
+            # NOTE (alkurbatov): Keep moving while the marine is selected.
+            if cannot(obs, actions.FUNCTIONS.Move_screen.id):
+                if self.planner.action == ACTION_MOVE_TO_BEACON:
+                    print('[WARNING] Nothing selected?')
 
-            if not marine_y.any():
-                # NOTE (alkurbatov): Sometimes we are too fast and the marine
-                # hasn't been placed on the screen yet.
+                self.planner.start(ACTION_SELECT_MARINE)
                 return actions.FUNCTIONS.no_op()
 
-            if len(marine_y) < DIAMETERS.get(units.Terran.Marine):
-                # NOTE (alkurbatov): Sometimes we receive not fully formed
-                # marine coordinates probably because we are too fast again.
-                # Just ignore it.
-                return actions.FUNCTIONS.no_op()
-
-            # NOTE (alkurbatov): There is only one marine on the screen and
-            # no other objects around it so it is safe to select any point
-            # in the list.
-            marine = UnitPos(marine_x, marine_y)
-
-            self.smart_action = ACTION_MOVE_TO_BEACON
-            return actions.FUNCTIONS.select_point('select', marine.pos)
-
-        if self.smart_action == ACTION_MOVE_TO_BEACON:
-            if actions.FUNCTIONS.Move_screen.id not in obs.observation.available_actions:
-                print('[WARNING] Nothing selected?')
-                self.smart_action = ACTION_SELECT_MARINE
-                return actions.FUNCTIONS.no_op()
-
-            player_relative = obs.observation.feature_screen.player_relative
-            beacon_y, beacon_x = (player_relative == features.PlayerRelative.NEUTRAL).nonzero()
-            if not beacon_y.any():
-                print('[WARNING] Where is your beacon?')
-                return actions.FUNCTIONS.no_op()
-
-            beacon = UnitPos(beacon_x, beacon_y)
-
-            return actions.FUNCTIONS.Move_screen('now', beacon.pos)
-
-        return actions.FUNCTIONS.no_op()
+            self.planner.start(ACTION_MOVE_TO_BEACON)
+
+        return self.planner.step(obs)
+
+    def select_marine(self, obs):
+        """Select the marine, waits until it is fully placed on the screen."""
+        unit_type = obs.observation.feature_screen.unit_type
+        marine_y, marine_x = (unit_type == units.Terran.Marine).nonzero()
+
+        if not marine_y.any():
+            # NOTE (alkurbatov): Sometimes we are too fast and the marine
+            # hasn't been placed on the screen yet.
+            return None
+
+        if len(marine_y) < footprint(units.Terran.Marine, resolution(unit_type)):
+            # NOTE (alkurbatov): Sometimes we receive not fully formed
+            # marine coordinates probably because we are too fast again.
+            # Just ignore it.
+            return None
+
+        # NOTE (alkurbatov): There is only one marine on the screen and
+        # no other objects around it so it is safe to select any point
+        # in the list.
+        marine = UnitPos(marine_x, marine_y)
+        return actions.FUNCTIONS.select_point('select', marine.pos)
+
+    def move_to_beacon(self, obs):
+        """Move the selected marine to the beacon."""
+        player_relative = obs.observation.feature_screen.player_relative
+        neutral = player_relative == features.PlayerRelative.NEUTRAL
+        beacon_y, beacon_x = neutral.nonzero()
+        if not beacon_y.any():
+            print('[WARNING] Where is your beacon?')
+            return None
+
+        beacon = UnitPos(beacon_x, beacon_y)
+        return actions.FUNCTIONS.Move_screen('now', beacon.pos)
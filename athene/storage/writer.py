@@ -0,0 +1,89 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Background persistence of the agents data, so saving at the end of
+an episode doesn't stall the game loop.
+"""
+
+import atexit
+import contextlib
+import os
+import queue
+import threading
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb'):
+    """Open a temporary file for writing and move it to the specified path
+    once writing is done, so the path never contains a half-written file.
+    """
+    tmp = '{}.tmp'.format(path)
+
+    try:
+        with open(tmp, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, path)
+    finally:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+
+
+class BackgroundWriter:
+    """Runs the save jobs one by one on a worker thread.
+    Submitting blocks while the queue of the pending jobs is full,
+    i.e. the previous saves are still running.
+    Errors raised by the jobs are re-raised on the next submit() or wait().
+    """
+
+    def __init__(self, max_pending=2):
+        self.error = None
+
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='athene-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    def submit(self, job, *args):
+        """Schedule the job to be called with the specified arguments."""
+        self._raise_error()
+        self._jobs.put((job, args))
+
+    def wait(self):
+        """Wait until all the submitted jobs are done."""
+        self._jobs.join()
+        self._raise_error()
+
+    def close(self):
+        """Finish the pending jobs and stop the worker thread."""
+        if not self._thread.is_alive():
+            return
+
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _raise_error(self):
+        """Re-raise an error of a finished job, if any."""
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._jobs.get()
+
+            try:
+                if item is None:
+                    return
+
+                job, args = item
+                job(*args)
+            except Exception as error:  # pylint: disable=broad-except
+                self.error = error
+            finally:
+                self._jobs.task_done()
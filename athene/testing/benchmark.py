@@ -0,0 +1,398 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Headless benchmarks of the agents and of the hot paths they use,
+played on the fake environments (see athene.testing.env).
+
+To run the benchmarks and save the results do:
+$ python -m athene.testing.benchmark --output benchmark.json
+
+To compare the results with the saved ones and fail on regressions do:
+$ python -m athene.testing.benchmark --baseline benchmark.json --tolerance 0.2
+"""
+
+import contextlib
+import functools
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+
+import numpy
+from pysc2.lib import actions
+from pysc2.lib import units
+
+from athene.metrics.profiler import Phase
+from athene.testing.env import ENVS
+
+
+BENCHMARKS = {}
+
+# NOTE (alkurbatov): Number of the prerecorded observations, the located
+# units are cached per observation so the same one is never used twice
+# in a row.
+OBSERVATIONS = 32
+
+# NOTE (alkurbatov): Units located by the collect minerals agent.
+TRACKED = (
+    units.Terran.CommandCenter,
+    units.Terran.Refinery,
+    units.Terran.SCV,
+    units.Terran.SupplyDepot,
+)
+
+# NOTE (alkurbatov): Modules which import time is measured.
+IMPORTS = {
+    'import.collect_minerals_and_gas': 'athene.minigames.collect_minerals_and_gas',
+    'import.move_to_beacon': 'athene.minigames.move_to_beacon',
+    'import.qlearning': 'athene.brain.qlearning',
+    'import.screen': 'athene.api.screen',
+}
+
+
+def benchmark(name):
+    """Register function measuring the named benchmark. The function
+    receives the benchmark options and returns the measured Phase.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+class Options:
+    """Parameters of the benchmarks.
+
+        Meaning of variables:
+        resolution - size of the screen of the fake environments.
+        repeat     - multiplier of the number of measured calls.
+        seed       - seed of the fake environments and of the agents.
+    """
+
+    def __init__(self, resolution=84, repeat=1, seed=0):
+        self.resolution = resolution
+        self.repeat = repeat
+        self.seed = seed
+
+    def env(self, map_name, **kwargs):
+        """Create the fake environment."""
+        return ENVS[map_name](resolution=self.resolution, seed=self.seed, **kwargs)
+
+
+def play(env, agent, episodes, phase):
+    """Play the episodes measuring each step of the agent."""
+    agent.setup(env.observation_spec()[0], env.action_spec()[0])
+
+    for _ in range(episodes):
+        timesteps = env.reset()
+        agent.reset()
+
+        while True:
+            with phase:
+                step_actions = [agent.step(timesteps[0])]
+
+            if timesteps[0].last():
+                break
+
+            timesteps = env.step(step_actions)
+
+    return phase
+
+
+def observations(options, map_name, count=OBSERVATIONS):
+    """Record observations of the fake environment played by random actions."""
+    env = options.env(map_name, episode_length=count)
+    timesteps = env.reset()
+    recorded = [timesteps[0]]
+
+    rand = random.Random(options.seed)
+    while not timesteps[0].last():
+        point = [rand.randrange(env.width), rand.randrange(env.height)]
+        timesteps = env.step([actions.FUNCTIONS.select_point('select', point)])
+        recorded.append(timesteps[0])
+
+    return recorded
+
+
+def measure(phase, func, args, calls):
+    """Call the function with each of the arguments in turn."""
+    for i in range(calls):
+        arg = args[i % len(args)]
+        with phase:
+            func(*arg)
+
+    return phase
+
+
+@benchmark('move_to_beacon.step')
+def move_to_beacon_step(options):
+    from athene.minigames.move_to_beacon import Agent
+
+    # NOTE (alkurbatov): The agent is too talkative.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return play(options.env('MoveToBeacon'), Agent(),
+                    5 * options.repeat, Phase('step'))
+
+
+@benchmark('collect_minerals_and_gas.step')
+def collect_minerals_and_gas_step(options):
+    from athene.minigames.collect_minerals_and_gas import Agent
+
+    random.seed(options.seed)
+    with tempfile.TemporaryDirectory() as data_folder:
+        agent = Agent(data_folder=data_folder)
+        phase = play(options.env('CollectMineralsAndGas'), agent,
+                     3 * options.repeat, Phase('step'))
+
+        agent.writer.wait()
+        agent.metrics.flush()
+
+    return phase
+
+
+@benchmark('screen.locate')
+def screen_locate(options):
+    from athene.api.screen import UnitPosList
+
+    args = [(obs, units.Terran.SCV)
+            for obs in observations(options, 'CollectMineralsAndGas')]
+    return measure(Phase('locate'), UnitPosList.locate, args, 500 * options.repeat)
+
+
+@benchmark('screen.locate_many')
+def screen_locate_many(options):
+    from athene.api.screen import locate_many
+
+    args = [(obs, TRACKED) for obs in observations(options, 'CollectMineralsAndGas')]
+    return measure(Phase('locate'), locate_many, args, 500 * options.repeat)
+
+
+@benchmark('screen.track')
+def screen_track(options):
+    from athene.api.screen import ScreenTracker
+
+    # NOTE (alkurbatov): The tracker needs the observations in order,
+    # so the same episode is replayed.
+    recorded = observations(options, 'CollectMineralsAndGas')
+    tracker = ScreenTracker(TRACKED)
+    phase = Phase('track')
+
+    for _ in range(500 * options.repeat // len(recorded)):
+        for obs in recorded:
+            with phase:
+                tracker.update(obs)
+
+    return phase
+
+
+@benchmark('screen.locate_blobs')
+def screen_locate_blobs(options):
+    from athene.api.screen import UnitPosBlobsList
+
+    args = [(obs, units.Neutral.MineralField)
+            for obs in observations(options, 'CollectMineralsAndGas')]
+    return measure(Phase('locate'), UnitPosBlobsList.locate, args,
+                   200 * options.repeat)
+
+
+@benchmark('screen.locate_coarse')
+def screen_locate_coarse(options):
+    from athene.api.screen import UnitPosBlobsList
+
+    args = [(obs, units.Neutral.MineralField, True)
+            for obs in observations(options, 'CollectMineralsAndGas')]
+    return measure(Phase('locate'), UnitPosBlobsList.locate, args,
+                   200 * options.repeat)
+
+
+@benchmark('screen.locate_clusters')
+def screen_locate_clusters(options):
+    from athene.api.screen import UnitPosClustersList
+
+    args = [(obs, units.Neutral.MineralField)
+            for obs in observations(options, 'CollectMineralsAndGas')]
+
+    # NOTE (alkurbatov): The first call imports scikit-learn.
+    UnitPosClustersList.locate(*args[-1])
+
+    return measure(Phase('locate'), UnitPosClustersList.locate, args,
+                   10 * options.repeat)
+
+
+def import_time(module, options):
+    """Measure import of the module by a fresh interpreter, i.e. the startup
+    time of a worker process using it.
+    """
+    phase = Phase('import')
+    for _ in range(5 * options.repeat):
+        with phase:
+            subprocess.run([sys.executable, '-c', 'import {}'.format(module)], check=True)
+
+    return phase
+
+
+BENCHMARKS.update(
+    (name, functools.partial(import_time, module)) for name, module in IMPORTS.items())
+
+
+def _qlearning_table(options, states):
+    """Create table of the collect minerals agent and random states for it."""
+    from athene.brain.qlearning import QLearningTable
+    from athene.minigames.collect_minerals_and_gas import Agent
+
+    rand = random.Random(options.seed)
+    random.seed(options.seed)
+
+    qlearn = QLearningTable(Agent.SMART_ACTIONS, encoder=Agent.STATE)
+    visited = [
+        (rand.randrange(8), rand.randrange(64), rand.randrange(3),
+         rand.randrange(3), rand.randrange(3))
+        for _ in range(states)
+    ]
+    return qlearn, visited, rand
+
+
+@benchmark('qlearning.choose_action')
+def qlearning_choose_action(options):
+    qlearn, visited, rand = _qlearning_table(options, 1000)
+    excluded = [set(rand.sample(qlearn.actions, 2)) for _ in range(len(visited))]
+
+    return measure(Phase('choose_action'), qlearn.choose_action,
+                   list(zip(visited, excluded)), 5000 * options.repeat)
+
+
+@benchmark('qlearning.learn')
+def qlearning_learn(options):
+    qlearn, visited, rand = _qlearning_table(options, 1000)
+    args = [
+        (visited[i], rand.choice(qlearn.actions), rand.random(),
+         visited[(i + 1) % len(visited)])
+        for i in range(len(visited))
+    ]
+
+    return measure(Phase('learn'), qlearn.learn, args, 5000 * options.repeat)
+
+
+@benchmark('qlearning.learn_batch')
+def qlearning_learn_batch(options):
+    qlearn, visited, rand = _qlearning_table(options, 1000)
+
+    batches = []
+    for _ in range(8):
+        chosen = [rand.randrange(len(visited)) for _ in range(256)]
+        batches.append((
+            [visited[i] for i in chosen],
+            [rand.choice(qlearn.actions) for _ in chosen],
+            [rand.random() for _ in chosen],
+            [visited[(i + 1) % len(visited)] for i in chosen],
+        ))
+
+    return measure(Phase('learn_batch'), qlearn.learn_batch, batches,
+                   50 * options.repeat)
+
+
+@benchmark('policy.choose_action')
+def policy_choose_action(options):
+    from athene.brain.policy import GreedyPolicy
+
+    qlearn, visited, rand = _qlearning_table(options, 1000)
+    for i, state in enumerate(visited):
+        qlearn.learn(state, rand.choice(qlearn.actions), rand.random(),
+                     visited[(i + 1) % len(visited)])
+
+    excluded = [set(rand.sample(qlearn.actions, 2)) for _ in range(len(visited))]
+    return measure(Phase('choose_action'), GreedyPolicy(qlearn).choose_action,
+                   list(zip(visited, excluded)), 5000 * options.repeat)
+
+
+def run(names, options):
+    """Run the benchmarks, returns results by the benchmarks names."""
+    results = {}
+    for name in names:
+        summary = BENCHMARKS[name](options).summary()
+        del summary['phase']
+
+        summary['per_sec'] = summary['calls'] / summary['total_ms'] * 1e3 \
+            if summary['total_ms'] else 0.0
+        results[name] = summary
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare mean latencies with the baseline ones.
+    Returns list of (name, ratio, regressed) for the common benchmarks.
+    """
+    report = []
+    for name, summary in sorted(results.items()):
+        if name not in baseline or not baseline[name]['mean_us']:
+            continue
+
+        ratio = summary['mean_us'] / baseline[name]['mean_us']
+        report.append((name, ratio, ratio > 1 + tolerance))
+
+    return report
+
+
+def main(argv):
+    del argv
+
+    from absl.flags import FLAGS
+
+    names = FLAGS.benchmarks or sorted(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        print('[ERROR] Unknown benchmarks: {}'.format(', '.join(sorted(unknown))))
+        return 2
+
+    options = Options(resolution=FLAGS.resolution, repeat=FLAGS.repeat, seed=FLAGS.seed)
+    results = run(names, options)
+
+    print('{:<32} {:>8} {:>12} {:>10} {:>10} {:>12}'.format(
+        'benchmark', 'calls', 'mean_us', 'p50_us', 'p99_us', 'per_sec'))
+    for name, summary in sorted(results.items()):
+        print('{:<32} {calls:>8} {mean_us:>12.1f} {p50_us:>10.1f} {p99_us:>10.1f} '
+              '{per_sec:>12.1f}'.format(name, **summary))
+
+    if FLAGS.output:
+        with open(FLAGS.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'numpy': numpy.__version__,
+                'resolution': options.resolution,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if not FLAGS.baseline:
+        return 0
+
+    with open(FLAGS.baseline) as f:
+        baseline = json.load(f)['results']
+
+    regressions = 0
+    for name, ratio, regressed in compare(results, baseline, FLAGS.tolerance):
+        print('[{}] {}: {:.2f}x of the baseline'.format(
+            'REGRESSION' if regressed else 'OK', name, ratio))
+        regressions += regressed
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    from absl import app
+    from absl import flags
+
+    flags.DEFINE_list('benchmarks', None, 'Benchmarks to run, all by default.')
+    flags.DEFINE_string('output', None, 'Save the results to the JSON file.')
+    flags.DEFINE_string('baseline', None, 'Compare with the results in the JSON file.')
+    flags.DEFINE_float('tolerance', 0.2, 'Allowed slowdown relative to the baseline.')
+    flags.DEFINE_integer('resolution', 84, 'Resolution of the screen.')
+    flags.DEFINE_integer('repeat', 1, 'Multiplier of the number of measured calls.')
+    flags.DEFINE_integer('seed', 0, 'Seed of the fake environments.')
+
+    app.run(main)
@@ -0,0 +1,458 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Headless imitation of the StarCraft II minigames producing pysc2-shaped
+observations, so the agents can be run and measured without the game.
+
+The units are placed by scripted layouts in the coordinates of the default
+84x84 screen and scaled to the requested resolution, each unit covers
+the number of points given by athene.api.geometry.footprint().
+Only the observations used by the agents are provided:
+feature_screen.unit_type, feature_screen.player_relative, player,
+available_actions and score_cumulative.
+"""
+
+import math
+import random
+from collections import namedtuple
+
+import numpy
+from pysc2.env import environment
+from pysc2.lib import actions
+from pysc2.lib import features
+from pysc2.lib import named_array
+from pysc2.lib import units
+
+from athene.api.geometry import BASE_RESOLUTION, BEACON, footprint
+
+
+SCREEN_LAYERS = ('player_relative', 'unit_type')
+
+ABILITIES = {
+    units.Terran.CommandCenter: (
+        actions.FUNCTIONS.Train_SCV_quick.id,
+    ),
+    units.Terran.Marine: (
+        actions.FUNCTIONS.Attack_screen.id,
+        actions.FUNCTIONS.Move_screen.id,
+    ),
+    units.Terran.SCV: (
+        actions.FUNCTIONS.Build_CommandCenter_screen.id,
+        actions.FUNCTIONS.Build_Refinery_screen.id,
+        actions.FUNCTIONS.Build_SupplyDepot_screen.id,
+        actions.FUNCTIONS.Harvest_Gather_screen.id,
+        actions.FUNCTIONS.Move_screen.id,
+    ),
+}
+
+
+class Unit(namedtuple('Unit', ['unit_type', 'owner', 'pos_x', 'pos_y'])):
+    """A unit placed on the screen, the position is in points of
+    the screen, the owner is one of features.PlayerRelative.
+    """
+
+
+class FakeEnv:
+    """Base class of the fake environments, follows the interface
+    of pysc2.env.sc2_env.SC2Env used by the agents.
+
+        Meaning of variables:
+        resolution     - size of the screen, a number or (width, height).
+        episode_length - number of agent steps in an episode.
+        seed           - seed of the scripted randomness, the same seed
+                         produces the same episodes.
+    """
+
+    def __init__(self, resolution=BASE_RESOLUTION, episode_length=120, seed=None):
+        if isinstance(resolution, int):
+            resolution = (resolution, resolution)
+
+        self.width, self.height = resolution
+        self.episode_length = episode_length
+        self.random = random.Random(seed)
+
+        self.units = []
+        self.selected = None
+        self.steps = 0
+        self.score = 0
+        self.player = dict.fromkeys((player.name for player in features.Player), 0)
+
+        self.layers = None
+
+    def observation_spec(self):
+        """Get shapes of the provided observations."""
+        return ({
+            'available_actions': (0,),
+            'feature_screen': (len(SCREEN_LAYERS), self.height, self.width),
+            'player': (len(features.Player),),
+            'score_cumulative': (len(features.ScoreCumulative),),
+        },)
+
+    def action_spec(self):
+        """Get description of the actions."""
+        return (actions.ValidActions(actions.TYPES, actions.FUNCTIONS),)
+
+    def reset(self):
+        """Start a new episode."""
+        self.units = []
+        self.selected = None
+        self.steps = 0
+        self.score = 0
+        self.player = dict.fromkeys(self.player, 0)
+        self.player['player_id'] = 1
+
+        self.new_game()
+        return self._timesteps(environment.StepType.FIRST, 0)
+
+    def step(self, step_actions):
+        """Apply the agent's action and advance the game by one step."""
+        self.steps += 1
+
+        reward = self.act(step_actions[0])
+        reward += self.tick()
+        self.score += reward
+
+        if self.steps >= self.episode_length:
+            return self._timesteps(environment.StepType.LAST, reward)
+
+        return self._timesteps(environment.StepType.MID, reward)
+
+    def close(self):
+        """Nothing to release."""
+
+    def new_game(self):
+        """Place the units of a new episode."""
+        raise NotImplementedError
+
+    def act(self, call):
+        """Apply the action, returns the reward."""
+        if call.function == actions.FUNCTIONS.select_point.id:
+            self.selected = self.unit_at(*_point(call))
+
+        return 0
+
+    def tick(self):
+        """Advance the game by one step, returns the reward."""
+        return 0
+
+    def available_actions(self):
+        """Get ids of the actions available in the current state."""
+        available = [
+            actions.FUNCTIONS.no_op.id,
+            actions.FUNCTIONS.select_point.id,
+            actions.FUNCTIONS.select_rect.id,
+        ]
+
+        if self.selected is not None:
+            available.extend(ABILITIES.get(self.selected.unit_type, ()))
+
+        return available
+
+    def scaled(self, pos_x, pos_y):
+        """Convert position on the default screen to the points of the screen."""
+        return (int(pos_x * self.width / BASE_RESOLUTION[0]),
+                int(pos_y * self.height / BASE_RESOLUTION[1]))
+
+    def place(self, unit_type, owner, pos_x, pos_y):
+        """Add unit at the position on the screen, returns the added unit."""
+        unit = Unit(unit_type, owner, pos_x, pos_y)
+        self.units.append(unit)
+        self.layers = None
+        return unit
+
+    def replace(self, unit, other):
+        """Replace the unit with another one, e.g. a moved one."""
+        self.units[self.units.index(unit)] = other
+        self.layers = None
+
+        if self.selected == unit:
+            self.selected = other
+
+    def unit_at(self, pos_x, pos_y):
+        """Get own unit covering the point or None."""
+        if not 0 <= pos_x < self.width or not 0 <= pos_y < self.height:
+            return None
+
+        self.render()
+        unit_type = self.layers['unit_type'][pos_y, pos_x]
+
+        for unit in reversed(self.units):
+            if unit.unit_type == unit_type and \
+               unit.owner == features.PlayerRelative.SELF and \
+               _covers(unit, self._sides(unit.unit_type), pos_x, pos_y):
+                return unit
+
+        return None
+
+    def render(self):
+        """Draw the units on the feature layers, the latest units are on top."""
+        if self.layers is not None:
+            return
+
+        self.layers = {
+            name: numpy.zeros((self.height, self.width), dtype=numpy.int32)
+            for name in SCREEN_LAYERS
+        }
+
+        for unit in self.units:
+            side_x, side_y = self._sides(unit.unit_type)
+            left = max(0, unit.pos_x - side_x // 2)
+            top = max(0, unit.pos_y - side_y // 2)
+            area = (slice(top, unit.pos_y - side_y // 2 + side_y),
+                    slice(left, unit.pos_x - side_x // 2 + side_x))
+
+            self.layers['unit_type'][area] = unit.unit_type
+            self.layers['player_relative'][area] = unit.owner
+
+    def _sides(self, unit_type):
+        """Get sides of the rectangle covered by the unit on the screen."""
+        area = footprint(unit_type, (self.width, self.height))
+        side_x = max(1, int(round(math.sqrt(area))))
+        return side_x, max(1, int(round(area / side_x)))
+
+    def _timesteps(self, step_type, reward):
+        """Make observation of the current state of the game."""
+        self.render()
+
+        # NOTE (alkurbatov): Like in pysc2 the layers are new arrays
+        # on each step.
+        screen = numpy.stack([self.layers[name] for name in SCREEN_LAYERS])
+        score = numpy.zeros(len(features.ScoreCumulative), dtype=numpy.int32)
+        score[features.ScoreCumulative.score] = self.score
+
+        observation = named_array.NamedDict({
+            'available_actions': numpy.array(self.available_actions(), dtype=numpy.int32),
+            'feature_screen': named_array.NamedNumpyArray(
+                screen, [SCREEN_LAYERS, None, None]),
+            'player': named_array.NamedNumpyArray(
+                [self.player[player.name] for player in features.Player],
+                names=features.Player, dtype=numpy.int32),
+            'score_cumulative': named_array.NamedNumpyArray(
+                score, names=features.ScoreCumulative),
+        })
+
+        discount = 0.0 if step_type == environment.StepType.LAST else 1.0
+        return (environment.TimeStep(step_type, reward, discount, observation),)
+
+
+class MoveToBeaconEnv(FakeEnv):
+    """The marine gets a point each time it reaches the beacon,
+    then the beacon is moved to a random place.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.marine = None
+        self.beacon = None
+
+    def new_game(self):
+        self.beacon = self.place(BEACON, features.PlayerRelative.NEUTRAL,
+                                 *self._random_position())
+        self.marine = self.place(units.Terran.Marine, features.PlayerRelative.SELF,
+                                 *self._random_position())
+
+    def act(self, call):
+        reward = super().act(call)
+
+        if call.function != actions.FUNCTIONS.Move_screen.id or \
+           self.selected != self.marine:
+            return reward
+
+        pos_x, pos_y = _point(call)
+        marine = self.marine._replace(pos_x=pos_x, pos_y=pos_y)
+        self.replace(self.marine, marine)
+        self.marine = marine
+
+        if not _covers(self.beacon, self._sides(BEACON), pos_x, pos_y):
+            return reward
+
+        pos_x, pos_y = self._random_position()
+        beacon = self.beacon._replace(pos_x=pos_x, pos_y=pos_y)
+        self.replace(self.beacon, beacon)
+        self.beacon = beacon
+
+        return reward + 1
+
+    def _random_position(self):
+        """Get random position on the screen away from the borders."""
+        return self.scaled(self.random.randint(10, 74), self.random.randint(10, 74))
+
+
+class CollectMineralsAndGasEnv(FakeEnv):
+    """A town hall, a few workers, a line of mineral fields and two geysers.
+    The workers bring minerals (and gas from the refineries) on each step,
+    the collected resources are the score.
+    """
+
+    MINERALS_PER_WORKER = 1
+    VESPENE_PER_REFINERY = 3
+    TRAINING_TIME = 12
+
+    COSTS = {
+        actions.FUNCTIONS.Build_CommandCenter_screen.id: (400, 0),
+        actions.FUNCTIONS.Build_Refinery_screen.id: (75, 0),
+        actions.FUNCTIONS.Build_SupplyDepot_screen.id: (100, 0),
+        actions.FUNCTIONS.Train_SCV_quick.id: (50, 0),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.training = []
+        self.idle_selected = False
+
+    def new_game(self):
+        self.training = []
+        self.idle_selected = False
+
+        self.player.update(minerals=50, food_used=12, food_cap=15,
+                           food_workers=12, idle_worker_count=2)
+
+        neutral = features.PlayerRelative.NEUTRAL
+        own = features.PlayerRelative.SELF
+
+        # NOTE (alkurbatov): The mineral fields are close to each other,
+        # so some of them merge into a single blob like in the game.
+        for pos_y in range(20, 68, 6):
+            self.place(units.Neutral.MineralField, neutral, *self.scaled(16, pos_y))
+
+        self.place(units.Neutral.VespeneGeyser, neutral, *self.scaled(30, 12))
+        self.place(units.Neutral.VespeneGeyser, neutral, *self.scaled(30, 72))
+        self.place(units.Terran.CommandCenter, own, *self.scaled(52, 42))
+
+        for _ in range(self.player['food_workers']):
+            self._place_worker()
+
+    def act(self, call):
+        function = call.function
+        if function not in self.available_actions():
+            return 0
+
+        idle_selected, self.idle_selected = self.idle_selected, False
+
+        if function == actions.FUNCTIONS.select_idle_worker.id:
+            self.selected = self._find(units.Terran.SCV)
+            self.idle_selected = True
+            return 0
+
+        minerals, vespene = self.COSTS.get(function, (0, 0))
+        if self.player['minerals'] < minerals or self.player['vespene'] < vespene:
+            return 0
+
+        if function == actions.FUNCTIONS.Harvest_Gather_screen.id:
+            if idle_selected:
+                self.player['idle_worker_count'] = 0
+
+            return 0
+
+        if function == actions.FUNCTIONS.Train_SCV_quick.id:
+            if self.player['food_used'] >= self.player['food_cap']:
+                return 0
+
+            self.player['food_used'] += 1
+            self.training.append(self.steps + self.TRAINING_TIME)
+
+        elif function == actions.FUNCTIONS.Build_SupplyDepot_screen.id:
+            self.place(units.Terran.SupplyDepot, features.PlayerRelative.SELF,
+                       *_point(call))
+            self.player['food_cap'] += 8
+
+        elif function == actions.FUNCTIONS.Build_CommandCenter_screen.id:
+            self.place(units.Terran.CommandCenter, features.PlayerRelative.SELF,
+                       *_point(call))
+            self.player['food_cap'] += 15
+
+        elif function == actions.FUNCTIONS.Build_Refinery_screen.id:
+            geyser = self._neutral_at(units.Neutral.VespeneGeyser, *_point(call))
+            if geyser is None:
+                return 0
+
+            self.replace(geyser, geyser._replace(
+                unit_type=units.Terran.Refinery, owner=features.PlayerRelative.SELF))
+
+        else:
+            return super().act(call)
+
+        self.player['minerals'] -= minerals
+        self.player['vespene'] -= vespene
+        return 0
+
+    def tick(self):
+        while self.training and self.training[0] <= self.steps:
+            self.training.pop(0)
+            self.player['food_workers'] += 1
+            self.player['idle_worker_count'] += 1
+            self._place_worker()
+
+        workers = self.player['food_workers'] - self.player['idle_worker_count']
+        minerals = workers * self.MINERALS_PER_WORKER
+        vespene = self.VESPENE_PER_REFINERY * sum(
+            1 for unit in self.units if unit.unit_type == units.Terran.Refinery)
+
+        self.player['minerals'] += minerals
+        self.player['vespene'] += vespene
+        return minerals + vespene
+
+    def available_actions(self):
+        available = super().available_actions()
+
+        if self.player['idle_worker_count']:
+            available.append(actions.FUNCTIONS.select_idle_worker.id)
+
+        return available
+
+    def _place_worker(self):
+        """Put a worker somewhere between the town hall and the minerals."""
+        self.place(units.Terran.SCV, features.PlayerRelative.SELF, *self.scaled(
+            self.random.randint(24, 40), self.random.randint(22, 62)))
+
+    def _find(self, unit_type):
+        """Get the first own unit of the specified type."""
+        for unit in self.units:
+            if unit.unit_type == unit_type:
+                return unit
+
+        return None
+
+    def _neutral_at(self, unit_type, pos_x, pos_y):
+        """Get neutral unit of the specified type covering the point or None."""
+        sides = self._sides(unit_type)
+        for unit in self.units:
+            if unit.unit_type == unit_type and _covers(unit, sides, pos_x, pos_y):
+                return unit
+
+        return None
+
+
+ENVS = {
+    'CollectMineralsAndGas': CollectMineralsAndGasEnv,
+    'MoveToBeacon': MoveToBeaconEnv,
+}
+
+
+class FakeEnvFactory:
+    """Creates the fake environment in a worker process,
+    see athene.training.runner.
+    """
+
+    def __init__(self, map_name, **kwargs):
+        self.map_name = map_name
+        self.kwargs = kwargs
+
+    def __call__(self):
+        return ENVS[self.map_name](**self.kwargs)
+
+
+def _point(call):
+    """Get the screen point of the action call."""
+    pos_x, pos_y = call.arguments[-1]
+    return int(pos_x), int(pos_y)
+
+
+def _covers(unit, sides, pos_x, pos_y):
+    """Check that the unit's rectangle covers the point."""
+    left = unit.pos_x - sides[0] // 2
+    top = unit.pos_y - sides[1] // 2
+    return left <= pos_x < left + sides[0] and top <= pos_y < top + sides[1]
@@ -0,0 +1,431 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+"""Parallel training of a QLearning agent in several environments.
+
+Each worker process runs its own environment and a local copy of
+the QLearning table. The transitions collected by the workers are sent to
+the learner (the main process) which owns the table, applies them using
+QLearningTable.learn_batch() and periodically sends the updated table back
+to the workers. The experience replay of the agent (if any) is done
+by the learner too.
+
+To run this code do:
+$ python -m athene.training.runner --map CollectMineralsAndGas --agent athene.minigames.collect_minerals_and_gas.Agent --workers 4
+"""
+
+import importlib
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+import numpy
+
+from athene.brain.qlearning import QLearningTable
+from athene.brain.replay import ReplayBuffer
+from athene.brain.states import TERMINAL, TERMINAL_KEY
+
+
+class TransitionsTable(QLearningTable):
+    """QLearning table of a worker. Learns as usual and records
+    the transitions and the excluded actions to be sent to the learner.
+    Each mask is recorded with number of the transitions learned before it,
+    so the learner could apply them in the same order.
+    """
+
+    def __init__(self, actions, encoder=None):
+        super().__init__(actions, encoder=encoder)
+        self.clear_log()
+
+    def choose_action(self, current_state, excluded_actions=None):
+        if excluded_actions is not None:
+            self.log['mask_at'].append(len(self.log['s']))
+            self.log['mask_keys'].append(self.encoder.encode(current_state))
+            self.log['masks'].append(self.action_mask(excluded_actions).copy())
+
+        return super().choose_action(current_state, excluded_actions)
+
+    def learn(self, s, a, r, s_):
+        super().learn(s, a, r, s_)
+
+        self.log['s'].append(self.encoder.encode(s))
+        self.log['a'].append(self.action_ids[a])
+        self.log['r'].append(r)
+        self.log['s_'].append(TERMINAL_KEY if s_ == TERMINAL else self.encoder.encode(s_))
+
+    def clear_log(self):
+        """Forget the recorded transitions."""
+        self.log = {
+            's': [], 'a': [], 'r': [], 's_': [],
+            'mask_at': [], 'mask_keys': [], 'masks': [],
+        }
+
+    def pop_log(self):
+        """Get the recorded transitions as arrays and clear the log."""
+        log = self.log
+        self.clear_log()
+
+        masks = numpy.zeros((len(log['masks']), len(self.actions)), dtype=numpy.bool_)
+        if log['masks']:
+            masks = numpy.array(log['masks'])
+
+        return {
+            's': numpy.array(log['s'], dtype=numpy.int64),
+            'a': numpy.array(log['a'], dtype=numpy.intp),
+            'r': numpy.array(log['r'], dtype=numpy.float64),
+            's_': numpy.array(log['s_'], dtype=numpy.int64),
+            'mask_at': numpy.array(log['mask_at'], dtype=numpy.intp),
+            'mask_keys': numpy.array(log['mask_keys'], dtype=numpy.int64),
+            'masks': masks,
+        }
+
+
+class SC2EnvFactory:
+    """Creates the StarCraft II environment in a worker process."""
+
+    def __init__(self, map_name, screen=84, minimap=64, step_mul=8):
+        self.map_name = map_name
+        self.screen = screen
+        self.minimap = minimap
+        self.step_mul = step_mul
+
+    def __call__(self):
+        # NOTE (alkurbatov): Imported here to not require the game
+        # in processes which don't run it.
+        from absl.flags import FLAGS
+        from pysc2.env import sc2_env
+        from pysc2.lib import features
+
+        if not FLAGS.is_parsed():
+            FLAGS.mark_as_parsed()
+
+        return sc2_env.SC2Env(
+            map_name=self.map_name,
+            players=[sc2_env.Agent(sc2_env.Race.terran)],
+            agent_interface_format=features.AgentInterfaceFormat(
+                feature_dimensions=features.Dimensions(
+                    screen=self.screen, minimap=self.minimap)),
+            step_mul=self.step_mul,
+            visualize=False,
+        )
+
+
+def run_episode(env, agent):
+    """Play a single episode, returns the last time step."""
+    timesteps = env.reset()
+    agent.reset()
+
+    while True:
+        step_actions = [agent.step(timesteps[0])]
+        if timesteps[0].last():
+            return timesteps[0]
+
+        timesteps = env.step(step_actions)
+
+
+def load_agent_class(path):
+    """Import agent class by its full name,
+    e.g. athene.minigames.collect_minerals_and_gas.Agent.
+    """
+    module, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+class Runner:
+    """Drives the workers and learns from their transitions.
+
+        Meaning of variables:
+        agent_class - QLearning agent class, must provide SMART_ACTIONS, STATE,
+                      DATA_FOLDER and accept data_folder and qlearn arguments.
+                      REPLAY_BATCHES and REPLAY_BATCH_SIZE enable
+                      the experience replay.
+        env_factory - picklable callable creating an environment
+                      in the worker process, see SC2EnvFactory.
+        sync_every  - number of episodes after which a worker receives
+                      the updated table from the learner.
+        dump_every  - number of episodes after which the learner saves
+                      the table.
+    """
+
+    # NOTE (alkurbatov): Seconds to wait for the results before checking
+    # that the workers are still alive.
+    POLL_INTERVAL = 5.0
+
+    def __init__(self, agent_class, env_factory, workers=None, data_folder=None,
+                 sync_every=1, dump_every=10):
+        self.agent_class = agent_class
+        self.env_factory = env_factory
+        self.workers = workers or os.cpu_count()
+        self.data_folder = data_folder or agent_class.DATA_FOLDER
+        self.sync_every = sync_every
+        self.dump_every = dump_every
+
+        self.qlearn = QLearningTable.load(
+            actions=agent_class.SMART_ACTIONS,
+            src=self.data_folder,
+            encoder=agent_class.STATE,
+        )
+        self.replay = ReplayBuffer.load(self.data_folder)
+
+        self.episodes = 0
+        self.scores = []
+
+    def run(self, episodes):
+        """Play the specified number of episodes in each worker.
+        Returns number of played episodes per hour.
+        """
+        context = multiprocessing.get_context()
+        results = context.Queue()
+        tables = [context.Queue() for _ in range(self.workers)]
+
+        processes = [
+            context.Process(
+                target=Worker(i, self.agent_class, self.env_factory, self.data_folder,
+                              episodes, self.sync_every),
+                args=(results, tables[i], self._table_record()),
+                daemon=True,
+            )
+            for i in range(self.workers)
+        ]
+
+        started_at = time.monotonic()
+        for process in processes:
+            process.start()
+
+        try:
+            finished = set()
+            exited = set()
+            while len(finished) < self.workers:
+                try:
+                    worker, payload = results.get(timeout=self.POLL_INTERVAL)
+                except queue.Empty:
+                    _check_alive(processes, finished, exited)
+                    continue
+
+                if payload is None:
+                    finished.add(worker)
+                    continue
+
+                if isinstance(payload, str):
+                    raise RuntimeError('Worker #{} failed:\n{}'.format(worker, payload))
+
+                self.learn(payload)
+
+                if payload['sync']:
+                    tables[worker].put(self._table_record())
+        finally:
+            for process in processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+
+        self.dump()
+
+        elapsed = time.monotonic() - started_at
+        return self.episodes * 3600 / elapsed if elapsed > 0 else 0.0
+
+    def learn(self, payload):
+        """Apply the transitions collected by a worker during an episode."""
+        log = payload['log']
+
+        # NOTE (alkurbatov): The worker learned each transition with the masks
+        # known at that moment, so the batch is split before a changed mask
+        # of a state which the pending transitions lead to.
+        start = 0
+        masks = {}
+        for end, key, mask in zip(log['mask_at'], log['mask_keys'], log['masks']):
+            previous = masks.get(key)
+            if previous is not None and numpy.array_equal(previous, mask):
+                continue
+
+            if end > start and numpy.any(log['s_'][start:end] == key):
+                self._learn_batch(log, start, end)
+                start = end
+
+            masks[key] = mask
+            self.qlearn.update_masks((key,), (mask,))
+
+        self._learn_batch(log, start, len(log['s']))
+
+        batches = getattr(self.agent_class, 'REPLAY_BATCHES', 0)
+        if batches:
+            self.replay.extend(log['s'], log['a'], log['r'], log['s_'])
+            self.replay.replay(
+                self.qlearn,
+                batch_size=self.agent_class.REPLAY_BATCH_SIZE,
+                batches=batches,
+                prioritized=True,
+            )
+
+        self.episodes += 1
+        self.scores.append(payload['score'])
+
+        if self.episodes % self.dump_every == 0:
+            self.dump()
+
+    def dump(self):
+        """Save the table and the remembered transitions."""
+        self.qlearn.dump(self.data_folder, delta=True)
+        if len(self.replay):
+            self.replay.dump(self.data_folder)
+
+    def _learn_batch(self, log, start, end):
+        """Apply the logged transitions from start to end."""
+        if end > start:
+            self.qlearn.learn_batch(
+                log['s'][start:end], log['a'][start:end], log['r'][start:end],
+                log['s_'][start:end], encoded=True)
+
+    def _table_record(self):
+        """Get the table data to be sent to a worker."""
+        return self.qlearn.record_meta(), self.qlearn.record_arrays()
+
+
+def _check_alive(processes, finished, exited):
+    """Raise if a worker died before reporting the end of its work,
+    e.g. was killed by the system. The workers exited normally are added
+    to the exited set and are given one more poll interval.
+    """
+    for worker, process in enumerate(processes):
+        if worker in finished or process.is_alive():
+            continue
+
+        # NOTE (alkurbatov): The last results of a worker exited normally
+        # could still be on the way.
+        if process.exitcode == 0 and worker not in exited:
+            exited.add(worker)
+            continue
+
+        raise RuntimeError('Worker #{} exited with code {} before finishing'.format(
+            worker, process.exitcode))
+
+
+class Worker:
+    """Plays the episodes in a worker process and sends the transitions
+    to the learner, see Runner.
+
+        Meaning of variables:
+        worker   - number of the worker.
+        episodes - number of the episodes to play.
+    """
+
+    def __init__(self, worker, agent_class, env_factory, data_folder, episodes,
+                 sync_every):
+        self.worker = worker
+        self.agent_class = agent_class
+        self.env_factory = env_factory
+        self.data_folder = data_folder
+        self.episodes = episodes
+        self.sync_every = sync_every
+
+    def __call__(self, results, tables, record):
+        """Entry point of the worker process. The logs are sent to the results
+        queue, the table updates are received from the tables queue.
+        """
+        try:
+            self.play(results, tables, record)
+        except Exception:  # pylint: disable=broad-except
+            results.put((self.worker, traceback.format_exc()))
+
+    def play(self, results, tables, record):
+        """Play the episodes starting with the specified table data."""
+        agent = _worker_agent_class(self.agent_class)(
+            os.path.join(self.data_folder, 'worker-{}'.format(self.worker)), record)
+
+        env = self.env_factory()
+        agent.setup(env.observation_spec()[0], env.action_spec()[0])
+
+        for episode in range(self.episodes):
+            last = run_episode(env, agent)
+            sync = (episode + 1) % self.sync_every == 0 and episode + 1 < self.episodes
+            results.put((self.worker, {
+                'log': agent.qlearn.pop_log(),
+                'score': float(last.observation.score_cumulative.score),
+                'sync': sync,
+            }))
+
+            if sync:
+                agent.sync(tables.get())
+
+        env.close()
+        results.put((self.worker, None))
+
+
+def _worker_agent_class(agent_class):
+    """Get the agent class for a worker process."""
+    class WorkerAgent(agent_class):
+        """The agent sends the transitions to the learner instead of
+        saving the table and replaying them.
+        """
+
+        def __init__(self, data_folder, record):
+            self.qlearn = _worker_table(agent_class, record)
+            super().__init__(data_folder=data_folder, qlearn=self.qlearn)
+
+        def save(self):
+            pass
+
+        def remember(self, s, a, r, s_):
+            pass
+
+        def replay_experience(self):
+            pass
+
+        def sync(self, record):
+            """Replace the local table with the learner's one."""
+            table = _worker_table(agent_class, record)
+            table.explorations = self.qlearn.explorations
+            self.qlearn = table
+
+    return WorkerAgent
+
+
+def _worker_table(agent_class, record):
+    """Create local table of a worker from the learner's table data."""
+    table = TransitionsTable(agent_class.SMART_ACTIONS, encoder=agent_class.STATE)
+    table.load_record(*record)
+    table.dirty.fill(False)
+    return table
+
+
+def main(argv):
+    del argv
+
+    from absl.flags import FLAGS
+
+    env_factory = SC2EnvFactory(FLAGS.map, screen=FLAGS.screen, minimap=FLAGS.minimap,
+                                step_mul=FLAGS.step_mul)
+    if FLAGS.fake:
+        from athene.testing.env import FakeEnvFactory
+        env_factory = FakeEnvFactory(FLAGS.map, resolution=FLAGS.screen)
+
+    runner = Runner(
+        load_agent_class(FLAGS.agent),
+        env_factory,
+        workers=FLAGS.workers,
+        sync_every=FLAGS.sync_every,
+    )
+
+    rate = runner.run(FLAGS.episodes)
+    print('[INFO] Played {} episodes, {:.1f} episodes/hour'.format(runner.episodes, rate))
+
+
+if __name__ == '__main__':
+    from absl import app
+    from absl import flags
+
+    flags.DEFINE_string('map', 'CollectMineralsAndGas', 'Name of the map.')
+    flags.DEFINE_string(
+        'agent', 'athene.minigames.collect_minerals_and_gas.Agent', 'Agent class.')
+    flags.DEFINE_integer('workers', os.cpu_count(), 'Number of environments.')
+    flags.DEFINE_integer('episodes', 10, 'Number of episodes per worker.')
+    flags.DEFINE_integer('sync_every', 1, 'Episodes between the table updates.')
+    flags.DEFINE_integer('screen', 84, 'Resolution of the screen.')
+    flags.DEFINE_integer('minimap', 64, 'Resolution of the minimap.')
+    flags.DEFINE_integer('step_mul', 8, 'Game steps per agent step.')
+    flags.DEFINE_bool('fake', False, 'Play in the fake environment, see athene.testing.')
+
+    app.run(main)
@@ -0,0 +1,151 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+import random
+
+import numpy
+import pytest
+
+from athene.brain.qlearning import QLearningTable
+from athene.brain.states import TERMINAL, StateEncoder
+
+
+ACTIONS = ['do_nothing', 'harvest', 'train', 'build']
+STATE = StateEncoder(ranges=(4, 4))
+
+
+def random_state(rng):
+    return rng.randrange(4), rng.randrange(4)
+
+
+def random_transitions(rng, count):
+    """Get transitions over a small state space, so the states repeat
+    within a batch and some transitions end the episode.
+    """
+    transitions = []
+    for _ in range(count):
+        s_ = TERMINAL if rng.random() < 0.1 else random_state(rng)
+        transitions.append(
+            (random_state(rng), rng.choice(ACTIONS), rng.uniform(-1, 1), s_))
+
+    return transitions
+
+
+def masked_tables(rng, **kwargs):
+    """Get two equal tables with some actions excluded in some states,
+    doing nothing is always allowed.
+    """
+    tables = [QLearningTable(ACTIONS, encoder=STATE, **kwargs) for _ in range(2)]
+    for _ in range(8):
+        state = random_state(rng)
+        excluded = {action for action in ACTIONS[1:] if rng.random() < 0.3}
+        for table in tables:
+            table.update_masks([STATE.encode(state)], [table.action_mask(excluded)])
+
+    return tables
+
+
+def assert_same(table, other):
+    columns = table.columns()
+    other_columns = other.columns()
+    order = numpy.argsort(columns['keys'])
+    other_order = numpy.argsort(other_columns['keys'])
+
+    for name in ('keys', 'q_values', 'disallowed_actions', 'visits', 'updated_at'):
+        assert numpy.allclose(columns[name][order], other_columns[name][other_order]), \
+            name
+
+    assert table.ticks == other.ticks
+
+
+def test_learn_batch_matches_learn():
+    rng = random.Random(0)
+
+    for trial in range(50):
+        sequential, batched = masked_tables(rng, alpha_decay=0.1 * (trial % 2))
+        transitions = random_transitions(rng, rng.randrange(1, 64))
+
+        for s, a, r, s_ in transitions:
+            sequential.learn(s, a, r, s_)
+
+        batched.learn_batch(*zip(*transitions))
+
+        assert_same(sequential, batched)
+
+
+def test_learn_batch_epochs():
+    rng = random.Random(1)
+    sequential, batched = masked_tables(rng)
+    transitions = random_transitions(rng, 32)
+
+    for _ in range(3):
+        for s, a, r, s_ in transitions:
+            sequential.learn(s, a, r, s_)
+
+    batched.learn_batch(*zip(*transitions), epochs=3)
+
+    assert_same(sequential, batched)
+
+
+def test_states_index_round_trip(tmp_path):
+    states = [5, 7, (1, 2), (0.5, 1.0), (0.7, 1.2), 'idle', (1, 2, 3), ('a', 1)]
+
+    table = QLearningTable(ACTIONS)
+    for i, state in enumerate(states):
+        table.learn(state, ACTIONS[i % len(ACTIONS)], i + 1, TERMINAL)
+
+    table.dump(str(tmp_path), delta=True)
+    table.learn('late', ACTIONS[0], 100, TERMINAL)
+    table.dump(str(tmp_path), delta=True)
+
+    loaded = QLearningTable.load(ACTIONS, str(tmp_path))
+
+    assert len(loaded) == len(states) + 1
+    for state in states + ['late']:
+        row = loaded.states[loaded.encode(state)]
+        expected = table.q_values[table.states[table.encode(state)]]
+        assert numpy.array_equal(loaded.q_values[row], expected), state
+
+
+@pytest.mark.parametrize('eviction', ['lru', 'lfu'])
+def test_bounded_matches_unbounded(tmp_path, eviction):
+    rng = random.Random(2)
+    encoder = StateEncoder(ranges=(32, 32))
+
+    def state():
+        return rng.randrange(32), rng.randrange(32)
+
+    unbounded = QLearningTable.load(ACTIONS, str(tmp_path / 'unbounded'), encoder=encoder)
+    bounded = QLearningTable.load(
+        ACTIONS, str(tmp_path / 'bounded'), encoder=encoder, max_states=100,
+        eviction=eviction)
+    for table in (unbounded, bounded):
+        table.COMPACT_EVERY = 3
+
+    for _ in range(30):
+        transitions = [(state(), rng.choice(ACTIONS), rng.uniform(-1, 1), state())
+                       for _ in range(20)]
+
+        for s, a, r, s_ in transitions:
+            unbounded.learn(s, a, r, s_)
+            bounded.learn(s, a, r, s_)
+
+        bounded.learn_batch(*zip(*transitions))
+        unbounded.learn_batch(*zip(*transitions))
+
+        unbounded.dump(str(tmp_path / 'unbounded'), delta=True)
+        bounded.dump(str(tmp_path / 'bounded'), delta=True)
+
+    assert bounded.evictions
+    assert len(bounded) <= 100
+    assert bounded.size == unbounded.size
+    assert_same(bounded, unbounded)
+
+    loaded = QLearningTable.load(ACTIONS, str(tmp_path / 'unbounded'), encoder=encoder)
+    loaded_bounded = QLearningTable.load(
+        ACTIONS, str(tmp_path / 'bounded'), encoder=encoder, max_states=100,
+        eviction=eviction)
+
+    assert_same(loaded, unbounded)
+    assert_same(loaded_bounded, unbounded)
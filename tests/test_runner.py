@@ -0,0 +1,137 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Alexander Kurbatov
+
+import os
+import signal
+
+import numpy
+import pytest
+
+from athene.brain.qlearning import QLearningTable
+from athene.minigames.collect_minerals_and_gas import Agent
+from athene.testing.env import FakeEnvFactory
+from athene.training.runner import Runner
+
+
+class RecordingAgent(Agent):
+    """Saves the table at the start and at the end of each episode."""
+
+    REPLAY_BATCHES = 0
+
+    def step(self, obs):
+        if obs.first():
+            self.dump_table('start-{}'.format(self.episodes))
+
+        call = super().step(obs)
+
+        if obs.last():
+            self.dump_table('end-{}'.format(self.episodes))
+
+        return call
+
+    def dump_table(self, name):
+        dst = os.path.join(self.data_folder, name)
+        os.makedirs(dst)
+        self.qlearn.dump(dst)
+
+
+class ReplayingAgent(RecordingAgent):
+    """The learner replays the transitions, so its table differs
+    from the one learned by the worker.
+    """
+
+    REPLAY_BATCHES = Agent.REPLAY_BATCHES
+
+
+class KilledAgent(Agent):
+    """The worker process is killed in the middle of the first episode."""
+
+    def step(self, obs):
+        if self.steps == 10:
+            os.kill(os.getpid(), signal.SIGKILL)
+
+        return super().step(obs)
+
+
+class RecordingRunner(Runner):
+    """Keeps copies of the tables sent to the workers."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = []
+
+    def _table_record(self):
+        self.sent.append(columns(self.qlearn))
+        return super()._table_record()
+
+
+def columns(qlearn):
+    """Get the states of the table sorted by keys."""
+    arrays = qlearn.columns()
+    order = numpy.argsort(arrays['keys'])
+    return {
+        name: arrays[name][order] for name in ('keys', 'q_values', 'disallowed_actions')
+    }
+
+
+def saved(agent_class, src):
+    """Get the states of the table saved by a worker."""
+    return columns(QLearningTable.load(agent_class.SMART_ACTIONS, src,
+                                       encoder=agent_class.STATE))
+
+
+def assert_same(table, other):
+    assert numpy.array_equal(table['keys'], other['keys'])
+    assert numpy.array_equal(table['disallowed_actions'], other['disallowed_actions'])
+    assert numpy.allclose(table['q_values'], other['q_values'])
+
+
+def test_learner_matches_worker(tmp_path):
+    episodes = 30
+    runner = Runner(
+        RecordingAgent,
+        FakeEnvFactory('CollectMineralsAndGas'),
+        workers=1,
+        data_folder=str(tmp_path),
+        sync_every=episodes,
+    )
+    runner.run(episodes)
+
+    assert runner.episodes == episodes
+
+    worker = saved(RecordingAgent, str(tmp_path / 'worker-0' / 'end-{}'.format(episodes)))
+    assert len(worker['keys']) > 1
+    assert_same(columns(runner.qlearn), worker)
+
+
+def test_workers_receive_table(tmp_path):
+    runner = RecordingRunner(
+        ReplayingAgent,
+        FakeEnvFactory('CollectMineralsAndGas'),
+        workers=1,
+        data_folder=str(tmp_path),
+        sync_every=1,
+    )
+    runner.run(2)
+
+    assert len(runner.sent) == 2
+
+    learned = saved(ReplayingAgent, str(tmp_path / 'worker-0' / 'end-1'))
+    received = saved(ReplayingAgent, str(tmp_path / 'worker-0' / 'start-2'))
+
+    assert_same(received, runner.sent[1])
+    assert not numpy.allclose(received['q_values'], learned['q_values'])
+
+
+def test_killed_worker(tmp_path):
+    runner = Runner(
+        KilledAgent,
+        FakeEnvFactory('CollectMineralsAndGas'),
+        workers=1,
+        data_folder=str(tmp_path),
+    )
+    runner.POLL_INTERVAL = 0.1
+
+    with pytest.raises(RuntimeError, match='exited with code'):
+        runner.run(2)